@@ -1,15 +1,40 @@
 from util.cst_to_dataset import cst_to_dataset
+from util.merge_datasets import merge_datasets
+import settings
 import os
 import argparse
 
 is_running_on_desktop = os.name == 'nt'
 
-# on the server, the partition id is passed as an argument
-if is_running_on_desktop:
-    partition_id = 0
-else:
+# the guard is required, since the worker processes import this module on
+# the desktop (windows)
+if __name__ == '__main__':
+
+    # the arguments are parsed on both the desktop and the server, on the
+    # desktop the partition id defaults to 0
     parser = argparse.ArgumentParser()
-    parser.add_argument("--partition_id", help="server partition id", type=int)
-    partition_id = parser.parse_args().partition_id
+    parser.add_argument("--partition_id", help="server partition id",
+                        type=int, default=0 if is_running_on_desktop else None)
+    parser.add_argument("--n_partitions", help="number of partitions",
+                        type=int, default=settings.Partitions.n)
+    parser.add_argument("--merge", action='store_true',
+                        help="merge the datasets of all partitions")
+    parser.add_argument("--rebuild", action='store_true',
+                        help="rebuild the dataset instead of resuming the "
+                             "previous build")
+    args = parser.parse_args()
 
-cst_to_dataset(partition_id)
+    # either merge the datasets of each partition or create the dataset of
+    # the given partition
+    if args.merge:
+        for dataset in ['msf', 'sar']:
+            merge_datasets(
+                ['dataset_%s_%i.zip' % (dataset, idx)
+                 for idx in range(args.n_partitions)],
+                'dataset_%s.zip' % dataset
+            )
+    else:
+        if args.partition_id is None:
+            parser.error('--partition_id is required on the server')
+        cst_to_dataset(args.partition_id, args.n_partitions,
+                       resume=settings.Manifest.resume and not args.rebuild)
@@ -11,6 +11,84 @@ class Paths:
         src = '/home/tue/s111167/generated_projects'
 
 
+class Partitions:
+    # number of partitions (shards) the projects are divided in, on the
+    # server each partition is processed by its own job (see server.sh)
+    if is_running_on_desktop:
+        n = 1
+    else:
+        n = 4
+
+
+class Parallel:
+    # number of worker processes used to load the projects, on the server
+    # this is limited to the cpus assigned to the job (--cpus-per-task)
+    if is_running_on_desktop:
+        n_processes = os.cpu_count()
+    else:
+        n_processes = len(os.sched_getaffinity(0))
+    # number of threads that encode png images (see util.png_pipeline), and
+    # the maximum number of images that wait to be written. On a single cpu
+    # the images are encoded and written by the main process itself (0).
+    n_threads_png = min(4, n_processes - 1)
+    queue_size = 256
+    # number of threads that scan the projects (see util.discovery), each
+    # listing and stat is a round trip on the network file system
+    n_threads_discovery = 16
+
+
+class Manifest:
+    # continue the previous build (see util.manifest)
+    resume = True
+    checkpoint_interval = 3600  # [s] time between checkpoints of the build
+
+
+class Memory:
+    # [bytes] memory available for the projects that the workers load ahead
+    # of the main process, which writes them to the dataset. This only
+    # bounds the (estimated) size of these projects, not the memory of the
+    # build as a whole.
+    budget = 2 ** 30
+
+
+class Metrics:
+    interval = 60  # [s] time between the progress lines of the build
+
+
+class Statistics:
+    # accumulate the statistics (mean, variance, min, max, histogram) of each
+    # input and output channel during the build, these are added to the
+    # metadata.json of the dataset. The workers then decode every image of
+    # each project, which slows down the build.
+    enabled = False
+
+
+class Output:
+    # besides the zip-files, save the images and parameters as .npy shards
+    # that can be memory-mapped (see util.npy_shards)
+    npy = False
+    shard_size = {'input': 1024, 'output': 65536}  # samples per shard
+
+
+class Cache:
+    # on-disk cache of intermediate results (see util.cache), e.g. the
+    # interpolated e-field of each antenna
+    enabled = True
+    path = 'cache'
+    max_size = 20 * 2 ** 30  # [bytes]
+    max_age = 30 * 24 * 3600  # [s] since the last usage
+
+
+class Compression:
+    # compression of the zip archives: 'stored', 'deflated', 'bzip2' or
+    # 'lzma', and its level (None: default level of the method)
+    zip_method = 'stored'
+    zip_level = None
+    # compression level (0-9) of the png images, None: the pngs of the
+    # projects are copied as they are and generated pngs use PIL's default
+    png_level = None
+
+
 class Imgs:
     width = 32
     height = width
@@ -21,14 +99,39 @@ class MSF:
     n = 3200
     phase_limit = [0., 2. * pi]
     amplitude_limit = [0., 1.]
+    batch_size = 256  # samples per matrix product in generate_msf_batch
+    seed = 0  # root seed of the random generators of the samples
+    # number of samples of which the random numbers are drawn at once, from
+    # a generator of their own (see mean_squared_field.block_rng). Changing
+    # it changes the samples.
+    rng_block = 256
+    # precision of the interpolation and the msf synthesis, 'float32' (with
+    # complex64 fields) halves the memory and bandwidth of 'float64'. See
+    # util.benchmark.benchmark_precision for its accuracy.
+    dtype = 'float64'
+    # bit depth of the msf images: 8 or 16 (16-bit png, uint16 in the .npy
+    # shards), the latter preserves the dynamic range of the msf
+    bit_depth = 8
 
 
 class DXF:
     background = 0
-    n_arc = 1000  # number of points used to approximate an arc
+    # maximum distance between the points that approximate an arc [px]
+    arc_tolerance = 0.1
     scalar_permittivity = 1. / 80
     scalar_density = 1. / 2160
     scalar_conductivity = 1. / 1.01
     per0 = 80
     con0 = 0
     den0 = 0
+    # maps that are generated from the model, key: (material property,
+    # scalar, value of the background)
+    maps = {
+        'per': ('permittivity', scalar_permittivity, per0),
+        'con': ('conductivity', scalar_conductivity, con0),
+        'den': ('density', scalar_density, den0),
+    }
+    # rasterise the model at supersample x the resolution of the maps and
+    # average the blocks of pixels, such that the pixels at the edges of an
+    # object contain a partial volume (1: no supersampling)
+    supersample = 1
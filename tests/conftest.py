@@ -0,0 +1,56 @@
+import json
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import settings
+
+N_ANTENNAS = 12
+MAPS = ['conductivity', 'density', 'model', 'permittivity']
+
+
+def write_project(path_project, n_outputs: int = 3, seed: int = 0,
+                  size: int = 8) -> None:
+    """
+    Writes a project as exported by CST, with random images: the maps,
+    n_outputs msf and sar images with their configuration and an (empty)
+    e-field that marks the simulation as finished.
+    """
+    rng = np.random.default_rng(seed)
+    path_project.joinpath('maps').mkdir(parents=True)
+    for img in MAPS:
+        Image.fromarray(rng.integers(0, 256, (size, size), np.uint8)).save(
+            path_project.joinpath('maps', img + '.png')
+        )
+    for dataset in ['msf', 'sar']:
+        path_project.joinpath(dataset).mkdir()
+        cnf = []
+        for idx in range(n_outputs):
+            # noise (msf) and uniform (sar) images, such that the images of
+            # both datasets differ in size
+            filename = '%s_%04i.png' % (dataset, idx)
+            img = rng.integers(0, 256, (size, size), np.uint8)
+            if dataset == 'sar':
+                img[:] = img[0, 0]
+            Image.fromarray(img).save(path_project.joinpath(dataset, filename))
+            cnf.append({'filename': filename,
+                        'amplitudes': rng.uniform(0, 1, N_ANTENNAS).tolist(),
+                        'phases': rng.uniform(0, 6, N_ANTENNAS).tolist()})
+        with open(path_project.joinpath(dataset, 'configuration.json'),
+                  'w') as file:
+            json.dump(cnf, file)
+    path_project.joinpath('e-field 11.csv').write_text('')
+
+
+@pytest.fixture
+def projects(tmp_path, monkeypatch):
+    # three projects in tmp_path/src, the build writes to tmp_path/build
+    path_src = tmp_path.joinpath('src')
+    for idx in range(3):
+        write_project(path_src.joinpath('project_%05i' % idx), seed=idx)
+    monkeypatch.setattr(settings.Paths, 'src', str(path_src))
+    path_build = tmp_path.joinpath('build')
+    path_build.mkdir()
+    monkeypatch.chdir(path_build)
+    return path_src
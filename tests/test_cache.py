@@ -0,0 +1,46 @@
+import os
+from time import time
+
+import numpy as np
+
+import settings
+from util.cache import Cache
+
+
+def test_key_depends_on_files_and_args(tmp_path):
+    path = tmp_path.joinpath('e-field 01.csv')
+    path.write_text('1;2;3\n')
+    key = Cache.key([path], 32, 32)
+    assert Cache.key([path], 32, 32) == key
+    assert Cache.key([path], 64, 64) != key
+
+    # a modified file invalidates the key
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert Cache.key([path], 32, 32) != key
+
+
+def test_save_load_and_evict(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings.Cache, 'enabled', True)
+    cache = Cache('cfa', str(tmp_path))
+    assert cache.load('a') is None
+    array = np.arange(1000.)
+    cache.save('a', cfa=array)
+    assert np.array_equal(cache.load('a')['cfa'], array)
+
+    # the least recently used file is removed once the cache is too large
+    path_a = tmp_path.joinpath('cfa', 'a.npz')
+    os.utime(path_a, (time() - 10, time() - 10))
+    monkeypatch.setattr(settings.Cache, 'max_size',
+                        int(1.5 * os.path.getsize(path_a)))
+    cache.save('b', cfa=array)
+    assert cache.load('a') is None
+    assert cache.load('b') is not None
+
+
+def test_disabled(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings.Cache, 'enabled', False)
+    cache = Cache('cfa', str(tmp_path))
+    cache.save('a', cfa=np.zeros(3))
+    assert cache.load('a') is None
+    assert not tmp_path.joinpath('cfa').exists()
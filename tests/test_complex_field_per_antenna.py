@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+import scipy.interpolate
+
+from util.complex_field_per_antenna import interpolation_operator
+
+
+@pytest.mark.parametrize('width, height', [(32, 32), (24, 40)])
+def test_operator_equals_regular_grid_interpolator(width, height):
+    # source grid as exported by CST, ordered by x first, with a different
+    # spacing along x and z
+    x_old = np.linspace(-100., 100., 41)
+    z_old = np.linspace(-90., 90., 31)
+    xx, zz = np.meshgrid(x_old, z_old, indexing='ij')
+    values = np.random.default_rng(0).normal(size=(xx.size, 6))
+
+    operator, (x_new, z_new) = interpolation_operator(
+        xx.ravel(), zz.ravel(), width, height
+    )
+    assert operator.shape == (width * height, xx.size)
+
+    # interpolation of each column as before the operator
+    for col in range(values.shape[1]):
+        interpolator = scipy.interpolate.RegularGridInterpolator(
+            (x_old, z_old), values[:, col].reshape(xx.shape)
+        )
+        expected = interpolator((x_new, z_new))
+        assert np.allclose(operator @ values[:, col], expected,
+                           rtol=0, atol=1e-12)
+
+    # the operator is reused for the same grid and resolution
+    assert interpolation_operator(xx.ravel(), zz.ravel(), width,
+                                  height)[0] is operator
@@ -0,0 +1,161 @@
+import io
+import json
+import os
+from zipfile import ZipFile
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import settings
+import util.cst_to_dataset
+from util.cst_to_dataset import DATASETS, cst_to_dataset
+from util.mean_squared_field import rng_metadata
+from util.merge_datasets import merge_datasets
+
+
+def _contents(path) -> dict:
+    with ZipFile(path, 'r') as zipfile:
+        return {name: zipfile.read(name) for name in zipfile.namelist()
+                if name != 'metadata.json'}
+
+
+@pytest.mark.parametrize('n_processes', [1, 2])
+def test_archives_are_valid(projects, n_processes):
+    # each input image is written to both archives, which must not share
+    # their zip info
+    cst_to_dataset(0, 1, n_processes)
+    for dataset in DATASETS:
+        with ZipFile('dataset_%s.zip' % dataset, 'r') as zipfile:
+            assert zipfile.testzip() is None
+            assert len([name for name in zipfile.namelist()
+                        if name.startswith('input/')]) == 3 * 4
+
+
+def test_writer_threads_equal_inline(projects, monkeypatch):
+    contents = {}
+    for n_threads in [0, 2]:
+        monkeypatch.setattr(settings.Parallel, 'n_threads_png', n_threads)
+        cst_to_dataset(0, 1, 1, resume=False)
+        for dataset in DATASETS:
+            with ZipFile('dataset_%s.zip' % dataset, 'r') as zipfile:
+                assert zipfile.testzip() is None
+            contents[dataset, n_threads] = _contents(
+                'dataset_%s.zip' % dataset
+            )
+    for dataset in DATASETS:
+        assert contents[dataset, 0] == contents[dataset, 2]
+
+
+def test_merged_partitions_equal_single_build(projects):
+    cst_to_dataset(0, 1, 1)
+    for partition_id in range(2):
+        cst_to_dataset(partition_id, 2, 1)
+    for dataset in DATASETS:
+        merge_datasets(['dataset_%s_%i.zip' % (dataset, idx)
+                        for idx in range(2)],
+                       'merged_%s.zip' % dataset, print_=lambda *args: None)
+        with ZipFile('merged_%s.zip' % dataset, 'r') as zipfile:
+            assert zipfile.testzip() is None
+        assert _contents('merged_%s.zip' % dataset) == \
+            _contents('dataset_%s.zip' % dataset)
+
+
+def _statistics(dataset) -> tuple:
+    # statistics in the metadata.json and the output images in the
+    # dataset.csv of a dataset
+    with ZipFile('dataset_%s.zip' % dataset, 'r') as zipfile:
+        statistics = json.loads(zipfile.read('metadata.json'))['statistics']
+        rows = zipfile.read('dataset.csv').decode().splitlines()[1:]
+        imgs = [np.asarray(Image.open(io.BytesIO(zipfile.read(
+            row.split(';')[-1])))) for row in rows]
+    return statistics, imgs
+
+
+def test_statistics(projects, monkeypatch):
+    monkeypatch.setattr(settings.Statistics, 'enabled', True)
+    cst_to_dataset(0, 1, 1, resume=False)
+
+    for dataset in DATASETS:
+        statistics, imgs = _statistics(dataset)
+        output = statistics['output']
+        assert output['n'] == sum(img.size for img in imgs)
+        assert output['mean'] == pytest.approx(np.mean(imgs))
+        assert output['max'] == np.max(imgs)
+        assert output['histogram'] == np.bincount(
+            np.concatenate(imgs).ravel(), minlength=256
+        ).tolist()
+
+    # the manifest keeps the moments of each project, without histograms
+    with open('manifest.json', 'r') as file:
+        manifest = json.load(file)
+    for project in manifest['projects'].values():
+        for statistics_ in [*project['statistics']['inputs'].values(),
+                            *project['statistics']['outputs'].values()]:
+            assert 'histogram' not in statistics_
+            assert 'edges' not in statistics_
+
+
+def test_statistics_exclude_stale_images(projects, monkeypatch):
+    monkeypatch.setattr(settings.Statistics, 'enabled', True)
+    cst_to_dataset(0, 1, 1, resume=False)
+
+    # modify a project, such that its images become stale
+    path = os.path.join(settings.Paths.src, 'project_00001', 'msf',
+                        'msf_0000.png')
+    os.utime(path, ns=(os.stat(path).st_atime_ns,
+                       os.stat(path).st_mtime_ns + 10 ** 9))
+    cst_to_dataset(0, 1, 1, resume=True)
+
+    for dataset in DATASETS:
+        statistics, imgs = _statistics(dataset)
+        output = statistics['output']
+        assert output['n'] == sum(img.size for img in imgs)
+        assert output['mean'] == pytest.approx(np.mean(imgs))
+        # the histograms of the stale images cannot be subtracted
+        assert 'histogram' not in output
+
+
+def test_no_statistics_by_default(projects):
+    cst_to_dataset(0, 1, 1)
+    with ZipFile('dataset_msf.zip', 'r') as zipfile:
+        assert 'statistics' not in json.loads(zipfile.read('metadata.json'))
+
+
+def test_no_pool_without_projects_to_load(projects, monkeypatch):
+    cst_to_dataset(0, 1, 1)
+
+    def pool(*args):
+        raise AssertionError('a pool is created')
+
+    # all projects are up to date
+    monkeypatch.setattr(util.cst_to_dataset, 'Pool', pool)
+    cst_to_dataset(0, 1, 2, resume=True)
+    with ZipFile('dataset_msf.zip', 'r') as zipfile:
+        assert zipfile.testzip() is None
+
+    # there are no projects
+    projects.parent.joinpath('none').mkdir()
+    monkeypatch.setattr(settings.Paths, 'src',
+                        str(projects.parent.joinpath('none')))
+    cst_to_dataset(0, 1, 2, resume=False)
+
+
+def test_rng_in_metadata(projects):
+    # a project of which the samples are drawn with another seed
+    with open(projects.joinpath('project_00001', 'rng.json'), 'w') as file:
+        json.dump(rng_metadata(settings.MSF.seed + 1), file)
+    with open(projects.joinpath('project_00002', 'rng.json'), 'w') as file:
+        json.dump(rng_metadata(), file)
+    cst_to_dataset(0, 1, 1)
+
+    with ZipFile('dataset_msf.zip', 'r') as zipfile:
+        assert json.loads(zipfile.read('metadata.json'))['rng'] == \
+            rng_metadata()
+    with ZipFile('dataset_sar.zip', 'r') as zipfile:
+        assert 'rng' not in json.loads(zipfile.read('metadata.json'))
+    with open('log.txt', 'r') as file:
+        log = file.read()
+    assert log.count('other random generators') == 1
+    assert log.index('other random generators') > \
+        log.index('project_00001')
@@ -0,0 +1,57 @@
+import shutil
+from zipfile import ZipFile
+
+from util.cst_to_dataset import DATASETS, cst_to_dataset
+from util.discovery import EFIELD, discover_projects
+
+from conftest import write_project
+
+
+def _invalid_projects(path_src) -> dict:
+    # a project of each kind of invalid project, with the reason why it is
+    # invalid
+    write_project(path_src.joinpath('project_unfinished'))
+    path_src.joinpath('project_unfinished', EFIELD).unlink()
+    write_project(path_src.joinpath('project_no_directory'))
+    shutil.rmtree(path_src.joinpath('project_no_directory', 'sar'))
+    write_project(path_src.joinpath('project_no_map'))
+    path_src.joinpath('project_no_map', 'maps', 'density.png').unlink()
+    write_project(path_src.joinpath('project_no_outputs'), n_outputs=0)
+    return {
+        'project_unfinished': 'simulation is not finished (no %s)' % EFIELD,
+        'project_no_directory': 'directory sar is missing',
+        'project_no_map': 'missing maps/density.png',
+        'project_no_outputs': 'no output images in msf',
+    }
+
+
+def test_invalid_projects(projects):
+    reasons = _invalid_projects(projects)
+    valid, invalid = discover_projects(projects, n_threads=2)
+    assert [project['name'] for project in valid] == \
+        ['project_%05i' % idx for idx in range(3)]
+    assert invalid == reasons
+    assert sorted(valid[0]['files']) == ['maps', 'msf', 'sar']
+    assert 'density.png' in valid[0]['files']['maps']
+
+
+def test_invalid_projects_are_skipped(projects):
+    reasons = _invalid_projects(projects)
+    cst_to_dataset(0, 1, 1)
+
+    # each skipped project is logged with its reason
+    with open('log.txt', 'r') as file:
+        log = file.read()
+    for name, reason in reasons.items():
+        assert 'skipping project %s, %s' % (name, reason) in log
+    assert '3 valid projects, 1 unfinished, 3 invalid' in log
+
+    # the input images of the valid projects are numbered without gaps
+    for dataset in DATASETS:
+        with ZipFile('dataset_%s.zip' % dataset, 'r') as zipfile:
+            assert zipfile.testzip() is None
+            assert sorted({name[-8:-4] for name in zipfile.namelist()
+                           if name.startswith('input/')}) == \
+                ['%04i' % idx for idx in range(3)]
+            rows = zipfile.read('dataset.csv').decode().splitlines()[1:]
+        assert len(rows) == 3 * 3
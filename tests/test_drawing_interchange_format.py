@@ -0,0 +1,187 @@
+from types import SimpleNamespace
+
+import cv2
+import numpy as np
+import pytest
+
+import settings
+from util.drawing_interchange_format import (DrawingInterchangeFormat,
+                                             _Line, _Object)
+
+RADIUS = 80.
+MATERIALS = [
+    {'object_name': 'head', 'permittivity': 40., 'conductivity': 0.5,
+     'density': 1000.},
+    {'object_name': 'object_0', 'permittivity': 20., 'conductivity': 0.9,
+     'density': 2000.},
+    {'object_name': 'object_1', 'permittivity': 60., 'conductivity': 0.1,
+     'density': 1500.},
+]
+
+
+def _polyline(layer, points, bulges=None, spline=False) -> list:
+    # tags of a (R12) POLYLINE entity, either a polyline with bulges or a
+    # spline fit
+    tags = ['0', 'POLYLINE', '8', layer, '66', '1',
+            '10', '0', '20', '0', '30', '0', '70', '4' if spline else '0']
+    if spline:
+        tags += ['75', '6']
+    for idx, (x, y) in enumerate(points):
+        tags += ['0', 'VERTEX', '8', layer,
+                 '10', repr(float(x)), '20', repr(float(y)), '30', '0']
+        if bulges is not None:
+            tags += ['42', repr(float(bulges[idx]))]
+        if spline:
+            tags += ['70', '8']
+    return tags + ['0', 'SEQEND', '8', layer]
+
+
+def write_dxf(path_project, n_pieces: int = 3, seed: int = 0) -> None:
+    # a head of two arcs that contains two overlapping ellipses, each split
+    # into shuffled and partly reversed pieces
+    rng = np.random.default_rng(seed)
+    path_project.mkdir(parents=True, exist_ok=True)
+    entities = _polyline('HEAD', [(RADIUS, 0.), (-RADIUS, 0.), (RADIUS, 0.)],
+                         bulges=[1., 1., 0.])
+    for idx, (center, axes) in enumerate([((-10., 5.), (40., 25.)),
+                                          ((15., -5.), (20., 45.))]):
+        theta = np.linspace(0, 2 * np.pi, 61)
+        points = np.column_stack([center[0] + axes[0] * np.cos(theta),
+                                  center[1] + axes[1] * np.sin(theta)])
+        bounds = np.linspace(0, 60, n_pieces + 1).astype(int)
+        for idx_piece in rng.permutation(n_pieces):
+            piece = points[bounds[idx_piece]:(bounds[idx_piece + 1] + 1)]
+            if idx_piece % 2:
+                piece = piece[::-1]
+            entities += _polyline('OBJECT_%i' % idx, piece, spline=True)
+    lines = ['0', 'SECTION', '2', 'ENTITIES'] + entities + \
+        ['0', 'ENDSEC', '0', 'EOF']
+    with open(path_project.joinpath('model2d.dxf'), 'w') as file:
+        file.write('\n'.join(lines) + '\n')
+
+
+@pytest.fixture
+def dxf(tmp_path):
+    write_dxf(tmp_path)
+    dxf = DrawingInterchangeFormat(tmp_path, MATERIALS, 0)
+    dxf.mm_per_px = 2 * RADIUS / settings.Imgs.width
+    return dxf
+
+
+def test_maps_equal_fill_per_map(dxf):
+    maps = dxf._generate_maps()
+    assert not dxf.open_contours
+
+    # maps as drawn before the label image, each map on its own by filling
+    # the contours of each object with its value
+    width, height = settings.Imgs.width, settings.Imgs.height
+    img_per = np.ones((height, width), np.uint8) * settings.DXF.per0
+    img_con = np.ones((height, width), np.uint8) * settings.DXF.con0
+    img_den = np.ones((height, width), np.uint8) * settings.DXF.den0
+    for name, lines in _contours(dxf).items():
+        m = MATERIALS[dxf.material_obj_names.index(name)]
+        cp = 255 * m['permittivity'] * settings.DXF.scalar_permittivity
+        cc = 255 * m['conductivity'] * settings.DXF.scalar_conductivity
+        cd = 255 * m['density'] * settings.DXF.scalar_density
+        for line in lines:
+            pnts = [line.pixels(dxf.mm_per_px, width, height)]
+            cv2.fillPoly(img_per, pnts, color=cp)
+            cv2.fillPoly(img_con, pnts, color=cc)
+            cv2.fillPoly(img_den, pnts, color=cd)
+
+    assert np.array_equal(maps['per'], img_per)
+    assert np.array_equal(maps['con'], img_con)
+    assert np.array_equal(maps['den'], img_den)
+    # all materials are visible
+    assert len(np.unique(maps['per'])) == len(MATERIALS) + 1
+
+
+def test_supersample_averages_blocks(dxf, monkeypatch):
+    maps = dxf._generate_maps()
+    monkeypatch.setattr(settings.DXF, 'supersample', 4)
+    maps_ss = dxf._generate_maps()
+    for key in maps:
+        assert maps_ss[key].shape == maps[key].shape
+        # only pixels at the edges of the objects differ
+        assert np.mean(maps_ss[key] != maps[key]) < 0.25
+
+
+def test_straight_segments_of_polyline():
+    # half a disk: an arc (bulge 1) from (r, 0) to (-r, 0) and a straight
+    # segment (bulge 0) back
+    vertices = [SimpleNamespace(location=location, bulge=bulge)
+                for location, bulge in [((RADIUS, 0., 0.), 1.),
+                                        ((-RADIUS, 0., 0.), 0.),
+                                        ((RADIUS, 0., 0.), 0.)]]
+    ent = SimpleNamespace(mode='polyline2d', vertices=vertices)
+    points = _Line(ent, np.array([1., 1.])).points
+
+    assert np.all(np.isfinite(points))
+    # the arc ends at the start of the segment, which is its 2 vertices
+    # (with swapped columns as the points of the arc)
+    assert np.allclose(points[-3:], [[0., -RADIUS], [0., -RADIUS],
+                                     [0., RADIUS]])
+    assert np.allclose(points[0], [0., RADIUS])
+    assert np.allclose(np.sum(points[:-2] ** 2, axis=1), RADIUS ** 2)
+    # the arc is on one side of the straight segment
+    assert np.all(points[:, 0] >= -1e-9) or np.all(points[:, 0] <= 1e-9)
+
+
+@pytest.mark.parametrize('n_pieces', [1, 2, 7])
+def test_stitch_shuffled_and_reversed_pieces(n_pieces):
+    # a closed polygon, split into shuffled and partly reversed pieces
+    rng = np.random.default_rng(n_pieces)
+    theta = np.linspace(0, 2 * np.pi, 71)
+    points = np.column_stack([30 * np.cos(theta), 20 * np.sin(theta)])
+    bounds = np.linspace(0, 70, n_pieces + 1).astype(int)
+    pieces = []
+    for idx_piece in rng.permutation(n_pieces):
+        piece = points[bounds[idx_piece]:(bounds[idx_piece + 1] + 1)]
+        pieces.append(piece[::-1] if rng.random() < 0.5 else piece)
+
+    obj = _object(pieces)
+    assert obj.stitch_lines(0.1) == 0
+    assert len(obj.lines) == 1
+    contour = obj.lines[0].points
+    assert len(contour) == 71 + n_pieces - 1
+    # consecutive points of the contour are neighbours on the polygon
+    steps = np.sum(np.diff(contour, axis=0) ** 2, axis=1) ** 0.5
+    assert np.all(steps < 1.1 * np.max(np.sum(
+        np.diff(points, axis=0) ** 2, axis=1) ** 0.5))
+
+    # without one of the pieces, the contour is open
+    if n_pieces > 1:
+        obj = _object(pieces[1:])
+        assert obj.stitch_lines(0.1) == 1
+        assert len(obj.lines) == 1
+
+
+def test_stitch_separate_contours():
+    # two separate squares of two pieces each, and a single open line
+    square = np.array([[0., 0.], [0., 1.], [1., 1.], [1., 0.], [0., 0.]])
+    pieces = [square[:3], square[2:] + 5, square[2:], (square[:3] + 5)[::-1],
+              np.array([[20., 20.], [21., 21.]])]
+    obj = _object(pieces)
+    assert obj.stitch_lines(0.1) == 1
+    assert len(obj.lines) == 3
+
+
+def _object(pieces) -> _Object:
+    obj = _Object()
+    for piece in pieces:
+        line = _Line.__new__(_Line)
+        line.points = piece
+        obj.lines.append(line)
+    return obj
+
+
+def _contours(dxf) -> dict:
+    # stitched contours of each object, as in _generate_maps
+    objects = {}
+    for ent in dxf.dxf.entities:
+        objects.setdefault(ent.layer, _Object()).lines.append(
+            _Line(ent, dxf.mm_per_px)
+        )
+    for obj in objects.values():
+        obj.stitch_lines(0.1)
+    return {name: obj.lines for name, obj in objects.items()}
@@ -0,0 +1,74 @@
+import os
+from zipfile import ZipFile
+
+import pytest
+
+import settings
+import util.cst_to_dataset
+from util.cst_to_dataset import DATASETS, cst_to_dataset
+from util.manifest import Manifest
+
+
+def _contents(path) -> dict:
+    with ZipFile(path, 'r') as zipfile:
+        assert zipfile.testzip() is None
+        return {name: zipfile.read(name) for name in zipfile.namelist()}
+
+
+def _rows(path) -> list:
+    with ZipFile(path, 'r') as zipfile:
+        return zipfile.read('dataset.csv').decode().splitlines()[1:]
+
+
+def test_resume_after_crash(projects, tmp_path, monkeypatch):
+    # reference: a build without interruption
+    os.mkdir('reference')
+    monkeypatch.chdir('reference')
+    cst_to_dataset(0, 1, 1, resume=False)
+    reference = {dataset: _contents('dataset_%s.zip' % dataset)
+                 for dataset in DATASETS}
+
+    # crash while loading the last project, after a checkpoint of the
+    # others, and leave a partially written image behind
+    monkeypatch.chdir('..')
+    monkeypatch.setattr(settings.Manifest, 'checkpoint_interval', -1)
+    load_project = util.cst_to_dataset._load_project
+
+    def crash(project, *args, **kwargs):
+        if project['name'] == 'project_00002':
+            raise RuntimeError('crash')
+        return load_project(project, *args, **kwargs)
+
+    monkeypatch.setattr(util.cst_to_dataset, '_load_project', crash)
+    with pytest.raises(RuntimeError):
+        cst_to_dataset(0, 1, 1, resume=False)
+    for dataset in DATASETS:
+        with open('dataset_%s.zip' % dataset, 'ab') as file:
+            file.write(b'partially written image')
+
+    # resume the build
+    monkeypatch.setattr(util.cst_to_dataset, '_load_project', load_project)
+    cst_to_dataset(0, 1, 1, resume=True)
+    for dataset in DATASETS:
+        assert _contents('dataset_%s.zip' % dataset) == reference[dataset]
+
+
+def test_modified_project_is_stale(projects):
+    cst_to_dataset(0, 1, 1, resume=False)
+
+    # modify the second project
+    path = os.path.join(settings.Paths.src, 'project_00001', 'msf',
+                        'msf_0000.png')
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    cst_to_dataset(0, 1, 1, resume=True)
+
+    manifest = Manifest('manifest.json', DATASETS).load()
+    for dataset in DATASETS:
+        assert manifest.stale[dataset] == [[3, 6]]
+        assert manifest.projects['project_00001']['cnt_out'][dataset] == \
+            [9, 12]
+        rows = _rows('dataset_%s.zip' % dataset)
+        ids = [int(row.split(';')[0]) for row in rows]
+        assert ids == [0, 1, 2, 6, 7, 8, 9, 10, 11]
+        assert rows[-1].endswith('output/%s_0000011.png' % dataset)
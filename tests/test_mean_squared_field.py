@@ -0,0 +1,135 @@
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import settings
+from util.complex_field_per_antenna import (COLUMNS, IMAG, REAL,
+                                            ComplexFieldPerAntenna)
+from util.mean_squared_field import MeanSquareField, quantize, rng_metadata
+from util.png_pipeline import encode_png
+
+
+def write_efields(path_project, n_antennas: int = 3, seed: int = 0) -> None:
+    # random e-field of each antenna on a regular grid, as exported by CST
+    rng = np.random.default_rng(seed)
+    path_project.mkdir(parents=True)
+    xx, zz = np.meshgrid(np.linspace(-50., 50., 11),
+                         np.linspace(-40., 40., 9), indexing='ij')
+    header = COLUMNS[:1] + ['y [mm]'] + COLUMNS[1:]
+    for idx in range(n_antennas):
+        data = np.column_stack([xx.ravel(), np.zeros(xx.size), zz.ravel(),
+                                rng.normal(size=(xx.size, 6))])
+        with open(path_project.joinpath('e-field %02i.csv' % (idx + 1)),
+                  'w') as file:
+            file.write(';'.join(header) + '\n')
+            np.savetxt(file, data, delimiter=';')
+
+
+@pytest.fixture
+def cfa(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings.Cache, 'enabled', False)
+    write_efields(tmp_path.joinpath('project'))
+    return ComplexFieldPerAntenna(tmp_path.joinpath('project'))
+
+
+def test_batch_equals_samples(cfa):
+    np.random.seed(0)
+    batch = MeanSquareField(cfa).generate_msf_batch(0, 5)
+
+    # the msf of each sample, computed per antenna & component
+    fields = cfa.cfa[:, :, :, REAL] + 1j * cfa.cfa[:, :, :, IMAG]
+    for idx in range(len(batch)):
+        weights = batch.amplitudes[idx] * np.exp(1j * batch.phases[idx])
+        field = np.einsum('a,pad->pd', weights, fields)
+        expected = 0.5 * np.sum(np.abs(field) ** 2, axis=1)
+        assert np.allclose(batch.msf[idx], expected, rtol=1e-12, atol=0)
+
+    # consecutive samples equal the batch
+    np.random.seed(0)
+    msf = MeanSquareField(cfa)
+    for idx in range(len(batch)):
+        sample = msf.generate_msf(idx)
+        assert sample.filename == batch.filenames[idx]
+        assert np.array_equal(sample.phases, batch.phases[idx])
+        assert np.array_equal(sample.amplitudes, batch.amplitudes[idx])
+        assert np.allclose(sample.msf, batch.msf[idx], rtol=1e-12, atol=0)
+        assert np.array_equal(sample.to_img(), batch.to_imgs()[idx])
+
+
+def test_float32_error_bound(cfa, tmp_path):
+    batch = MeanSquareField(cfa, 0).generate_msf_batch(0, 100)
+    cfa32 = ComplexFieldPerAntenna(tmp_path.joinpath('project'),
+                                   dtype='float32')
+    batch32 = MeanSquareField(cfa32, 0).generate_msf_batch(0, 100)
+    assert cfa32.cfa.dtype == np.float32 and batch32.msf.dtype == np.float32
+
+    # the same samples, with an error relative to the maximum of each
+    # sample within the precision of float32
+    assert np.array_equal(batch.phases, batch32.phases)
+    error = np.abs(batch32.msf - batch.msf) / \
+        batch.msf.max(axis=1, keepdims=True)
+    assert error.max() < 1e-5
+
+    # the 8-bit images differ by 1 at most
+    scalar = 1 / np.percentile(batch.msf, 99.9)
+    diff = quantize(batch32.msf, scalar, 8).astype(int) - \
+        quantize(batch.msf, scalar, 8)
+    assert np.abs(diff).max() <= 1
+
+
+def test_16_bit_round_trip(cfa, monkeypatch):
+    monkeypatch.setattr(settings.MSF, 'bit_depth', 16)
+    batch = MeanSquareField(cfa, 0).generate_msf_batch(0, 5)
+    batch.scalar = 1 / batch.msf.max()
+    imgs = batch.to_imgs()
+    assert imgs.dtype == np.uint16 and imgs.max() > 2 ** 15
+    # more values than an 8-bit image could hold
+    assert len(np.unique(imgs)) > 256
+
+    for img in imgs:
+        decoded = np.asarray(Image.open(io.BytesIO(encode_png(img))))
+        assert np.array_equal(decoded, img)
+
+    with pytest.raises(Exception):
+        quantize(batch.msf, batch.scalar, 12)
+
+
+def test_non_square_images(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings.Cache, 'enabled', False)
+    write_efields(tmp_path.joinpath('project'))
+    cfa = ComplexFieldPerAntenna(tmp_path.joinpath('project'), (12, 20))
+    msf = MeanSquareField(cfa, 0)
+    batch = msf.generate_msf_batch(0, 2)
+
+    # images of height x width, x varies along the rows and z along the
+    # columns
+    assert batch.to_imgs().shape == (2, 20, 12)
+    assert msf.generate_msf(2).to_img().shape == (20, 12)
+    xx, zz = cfa.xx.reshape(20, 12), cfa.zz.reshape(20, 12)
+    assert np.all(xx == xx[0]) and np.all(zz == zz[:, :1])
+
+
+def test_samples_do_not_depend_on_batches(cfa, monkeypatch):
+    # blocks of 4 samples, such that the batches cross their boundaries
+    monkeypatch.setattr(settings.MSF, 'rng_block', 4)
+    batch = MeanSquareField(cfa, 0).generate_msf_batch(0, 11)
+    assert np.all(batch.phases[:, 0] == 0)
+    assert len(np.unique(batch.phases[:, 1])) == 11
+
+    msf = MeanSquareField(cfa, 0)
+    for start, stop in [(5, 11), (0, 3), (3, 5)]:
+        part = msf.generate_msf_batch(start, stop - start, start)
+        assert np.array_equal(part.phases, batch.phases[start:stop])
+        assert np.array_equal(part.amplitudes, batch.amplitudes[start:stop])
+
+    # another root seed or project gives other samples
+    other = MeanSquareField(cfa, 1).generate_msf_batch(0, 11)
+    assert not np.any(other.phases[:, 1] == batch.phases[:, 1])
+    cfa.name = 'other'
+    other = MeanSquareField(cfa, 0).generate_msf_batch(0, 11)
+    assert not np.any(other.phases[:, 1] == batch.phases[:, 1])
+
+    assert rng_metadata(1)['seed'] == 1
+    assert rng_metadata()['rng_block'] == 4
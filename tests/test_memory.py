@@ -0,0 +1,43 @@
+from util.memory import imap_bounded
+
+
+class _Result:
+    def __init__(self, pool, value):
+        self.pool = pool
+        self.value = value
+
+    def get(self):
+        self.pool.in_flight.remove(self.value)
+        return self.value
+
+
+class _Pool:
+    # pool that records the items in flight, i.e. submitted and not returned
+    def __init__(self):
+        self.in_flight = []
+        self.max_in_flight = 0
+
+    def apply_async(self, func, args):
+        value = func(*args)
+        self.in_flight.append(value)
+        self.max_in_flight = max(self.max_in_flight,
+                                 sum(self.in_flight))
+        return _Result(self, value)
+
+
+def test_results_in_order_within_budget():
+    pool = _Pool()
+    items = [3, 1, 4, 1, 5, 9, 2, 6]
+    results = list(imap_bounded(pool, lambda item: item, items, items, 10))
+    assert results == items
+    assert pool.max_in_flight <= 10
+    assert pool.in_flight == []
+
+
+def test_item_larger_than_budget():
+    # an item that exceeds the budget is submitted on its own
+    pool = _Pool()
+    items = [2, 20, 2]
+    assert list(imap_bounded(pool, lambda item: item, items, items, 10)) \
+        == items
+    assert pool.max_in_flight == 20
@@ -0,0 +1,64 @@
+import json
+
+import settings
+from util.cst_to_dataset import DATASETS, cst_to_dataset
+from util.metrics import Metrics
+
+
+def _read(path) -> list:
+    with open(path, 'r') as file:
+        return [json.loads(line) for line in file]
+
+
+def test_lines_per_project_and_total(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings.Metrics, 'interval', 1e9)
+    metrics = Metrics(tmp_path.joinpath('metrics.jsonl'), 2)
+
+    metrics.add('write', 0.5, 2, 100)
+    with metrics.stage('write', 1, 50):
+        pass
+    assert list(metrics.timed(['a', 'b', 'c'], 'load')) == ['a', 'b', 'c']
+    # no progress line before the interval has passed
+    assert metrics.end_project('project_00000') is None
+
+    metrics.add('write', 0.25, 4, 200)
+    # after the last project
+    assert metrics.end_project('project_00001').startswith('2/2 projects')
+    metrics.close()
+
+    lines = _read(tmp_path.joinpath('metrics.jsonl'))
+    assert [line.get('project') for line in lines[:2]] == \
+        ['project_00000', 'project_00001']
+    first = lines[0]['stages']
+    assert set(first) == {'write', 'load'}
+    assert first['write']['items'] == 3 and first['write']['bytes'] == 150
+    assert first['write']['seconds'] >= 0.5
+    assert first['load']['items'] == 3
+    assert lines[1]['stages'] == {
+        'write': {'seconds': 0.25, 'items': 4, 'bytes': 200}
+    }
+    assert lines[2]['total']['write']['items'] == 7
+    assert lines[2]['total']['write']['bytes'] == 350
+    assert lines[2]['n_projects'] == 2 and lines[2]['seconds'] >= 0
+
+
+def test_build_metrics(projects):
+    cst_to_dataset(0, 1, 1)
+    lines = _read('metrics.jsonl')
+    assert [line['project'] for line in lines[:-1]] == \
+        ['project_%05i' % idx for idx in range(3)]
+
+    # 4 input and 3 output images per dataset of each project, the input
+    # images are read once for both datasets
+    for line in lines[:-1]:
+        stages = line['stages']
+        assert stages['write']['items'] == len(DATASETS) * (4 + 3)
+        assert stages['csv']['items'] == len(DATASETS) * 3
+        assert stages['load']['items'] == 1
+        assert stages['read']['items'] == 4 + len(DATASETS) * 3
+    total = lines[-1]['total']
+    assert total['write']['items'] == 3 * len(DATASETS) * (4 + 3)
+    assert total['write']['bytes'] == sum(
+        line['stages']['write']['bytes'] for line in lines[:-1]
+    )
+    assert lines[-1]['n_projects'] == 3
@@ -0,0 +1,35 @@
+import numpy as np
+
+from util.npy_shards import ShardWriter, load_shards
+
+
+def test_round_trip(tmp_path):
+    rng = np.random.default_rng(0)
+    outputs = rng.integers(0, 256, (10, 4, 5), np.uint8)
+    parameters = rng.uniform(size=(10, 24))
+
+    # write 6 samples, checkpoint (which saves a partial shard) and
+    # continue with a writer that is restored from the checkpoint
+    writer = ShardWriter(str(tmp_path), 4)
+    for idx in range(6):
+        assert writer.append(output=outputs[idx],
+                             parameters=parameters[idx]) == idx
+    shards = writer.checkpoint()
+    writer = ShardWriter(str(tmp_path), 4, list(shards))
+    for idx in range(6, 10):
+        assert writer.append(output=outputs[idx],
+                             parameters=parameters[idx]) == idx
+    writer.checkpoint([[2, 3]])
+
+    index, arrays = load_shards(str(tmp_path))
+    assert [(shard['start'], shard['stop']) for shard in index['shards']] \
+        == [(0, 4), (4, 6), (6, 10)]
+    assert index['arrays']['output'] == {'dtype': '|u1', 'shape': [4, 5]}
+    assert index['stale'] == [[2, 3]]
+    assert isinstance(arrays[0]['output'], np.memmap)
+    assert np.array_equal(
+        np.concatenate([shard['output'] for shard in arrays]), outputs
+    )
+    assert np.array_equal(
+        np.concatenate([shard['parameters'] for shard in arrays]), parameters
+    )
@@ -0,0 +1,106 @@
+import io
+import threading
+from zipfile import ZipFile, ZipInfo
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from util.png_pipeline import PNGWriter
+
+
+class _BlockingZipFile:
+    # zip-file of which writestr blocks until 'release' is set
+    def __init__(self):
+        self.release = threading.Event()
+        self.written = []
+
+    def writestr(self, filename, data, **kwargs):
+        self.release.wait()
+        self.written.append(filename)
+
+
+def _imgs(n: int) -> list:
+    # images of different sizes, such that they take a different time to
+    # encode
+    rng = np.random.default_rng(0)
+    return [rng.integers(0, 256, (8 * (1 + idx % 5), 16), np.uint8)
+            for idx in range(n)]
+
+
+@pytest.mark.parametrize('n_threads', [0, 4])
+def test_images_are_written_in_order(tmp_path, n_threads):
+    imgs = _imgs(50)
+    with ZipFile(tmp_path.joinpath('test.zip'), 'w') as zipfile:
+        with PNGWriter(zipfile, n_threads, queue_size=4) as writer:
+            for idx, img in enumerate(imgs):
+                writer.submit('%04i.png' % idx, img)
+
+    with ZipFile(tmp_path.joinpath('test.zip'), 'r') as zipfile:
+        assert zipfile.namelist() == ['%04i.png' % idx
+                                      for idx in range(len(imgs))]
+        for idx, img in enumerate(imgs):
+            decoded = Image.open(io.BytesIO(zipfile.read('%04i.png' % idx)))
+            assert np.array_equal(np.asarray(decoded), img)
+
+
+@pytest.mark.parametrize('n_threads', [0, 2])
+def test_staged_images(tmp_path, n_threads):
+    staged = (ZipInfo('staged.png', (2020, 1, 1, 0, 0, 0)), b'data')
+    with ZipFile(tmp_path.joinpath('test.zip'), 'w') as zipfile:
+        writer = PNGWriter(zipfile, n_threads)
+        writer.submit_staged('a.png', staged)
+        writer.submit_staged('b.png', staged)
+        writer.flush()
+        assert zipfile.namelist() == ['a.png', 'b.png']
+        writer.close()
+    # the zip info of the staged image is not shared by both members
+    assert staged[0].filename == 'staged.png'
+    with ZipFile(tmp_path.joinpath('test.zip'), 'r') as zipfile:
+        assert zipfile.testzip() is None
+        assert zipfile.read('b.png') == b'data'
+        assert zipfile.getinfo('b.png').date_time == (2020, 1, 1, 0, 0, 0)
+
+
+def test_encoder_error_is_raised(tmp_path):
+    imgs = _imgs(3)
+    with ZipFile(tmp_path.joinpath('test.zip'), 'w') as zipfile:
+        writer = PNGWriter(zipfile, n_threads=2)
+        writer.submit('0.png', imgs[0])
+        # PIL cannot encode an image of 7 channels
+        writer.submit('1.png', np.zeros((4, 4, 7), np.uint8))
+        with pytest.raises(TypeError):
+            writer.flush()
+        # the error is raised again, the next images are not written
+        with pytest.raises(TypeError):
+            writer.submit('2.png', imgs[2])
+        with pytest.raises(TypeError):
+            writer.close()
+        assert zipfile.namelist() == ['0.png']
+
+
+def test_queue_is_bounded():
+    zipfile = _BlockingZipFile()
+    writer = PNGWriter(zipfile, n_threads=2, queue_size=3)
+    imgs = _imgs(10)
+    n_submitted = []
+
+    def submit():
+        for idx, img in enumerate(imgs):
+            writer.submit('%i.png' % idx, img)
+            n_submitted.append(idx)
+
+    thread = threading.Thread(target=submit, daemon=True)
+    thread.start()
+    thread.join(0.5)
+
+    # the writer holds one image, the queue the next three, submit blocks
+    # on the fifth
+    assert thread.is_alive()
+    assert len(n_submitted) == 4
+    assert zipfile.written == []
+
+    zipfile.release.set()
+    thread.join(5)
+    writer.close()
+    assert zipfile.written == ['%i.png' % idx for idx in range(len(imgs))]
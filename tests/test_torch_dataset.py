@@ -0,0 +1,50 @@
+import io
+from zipfile import ZIP_DEFLATED, ZipFile
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from util.cst_to_dataset import cst_to_dataset
+from util.torch_dataset import CSTDataset
+
+
+def _decode(zipfile: ZipFile, name: str) -> np.ndarray:
+    return np.asarray(Image.open(io.BytesIO(zipfile.read(name))))
+
+
+def _deflate(path_src, path_dst) -> None:
+    # copy of the archive with deflated members
+    with ZipFile(path_src, 'r') as src, \
+            ZipFile(path_dst, 'w', ZIP_DEFLATED) as dst:
+        for name in src.namelist():
+            dst.writestr(name, src.read(name))
+
+
+@pytest.mark.parametrize('deflated', [False, True])
+def test_samples_equal_archive(projects, deflated):
+    cst_to_dataset(0, 1, 1, resume=False)
+    path = 'dataset_msf.zip'
+    if deflated:
+        _deflate(path, 'deflated.zip')
+        path = 'deflated.zip'
+
+    dataset = CSTDataset(path)
+    batch = dataset.__getitems__(list(range(len(dataset))))
+    with ZipFile(path, 'r') as zipfile:
+        rows = [row.split(';') for row in
+                zipfile.read('dataset.csv').decode().splitlines()[1:]]
+        assert len(dataset) == len(rows) == 9
+        for idx, row in enumerate(rows):
+            for col in range(3):
+                assert np.array_equal(batch['input'][idx, col].numpy(),
+                                      _decode(zipfile, row[1 + col]))
+            assert np.array_equal(batch['output'][idx, 0].numpy(),
+                                  _decode(zipfile, row[-1]))
+            assert np.allclose(batch['parameters'][idx].numpy(),
+                               np.array(row[4:-1], dtype=np.float32))
+
+    # a single sample equals the sample of the batch
+    sample = dataset[4]
+    assert sample['input'].shape == (3, 8, 8)
+    assert np.array_equal(sample['output'], batch['output'][4])
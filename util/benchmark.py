@@ -0,0 +1,334 @@
+import argparse
+import io
+import json
+import os
+import tempfile
+from pathlib import Path
+from time import time
+from zipfile import ZipFile
+
+import numpy as np
+import pandas as pd
+from PIL import Image
+
+import settings
+from .complex_field_per_antenna import (COLUMNS, COL_X, COL_Z, XYZ, COMPLEX,
+                                        ComplexFieldPerAntenna,
+                                        _interpolation_operator, read_efields)
+from .compression import png_kwargs, zip_kwargs
+from .cst_to_dataset import CSV
+from .drawing_interchange_format import DrawingInterchangeFormat
+from .mean_squared_field import MeanSquareField, quantize
+from .png_pipeline import encode_png
+from .synthetic_project import generate_project
+
+# stages of benchmark_stages, in the order they are executed
+STAGES = ['csv_load', 'interpolation', 'msf', 'dxf', 'png_encode',
+          'zip_write', 'csv_emit']
+
+
+def _time(fun, n_repeat: int):
+    # return the result and the best time of n_repeat calls
+    best = np.inf
+    result = None
+    for _ in range(n_repeat):
+        timer = time()
+        result = fun()
+        best = min(best, time() - timer)
+    return result, best
+
+
+def benchmark_efield_reader(path_project, n_repeat: int = 3) -> dict:
+    """
+    Compares the time to read the exported e-fields of a project with a
+    full pandas.read_csv (as before) and with read_efields (only the used
+    columns).
+    """
+    paths_efield = sorted(list(Path(path_project).glob('e-field*.csv')))
+    n_bytes = sum(path.stat().st_size for path in paths_efield)
+
+    def pandas_full():
+        return [pd.read_csv(path, delimiter=';') for path in paths_efield]
+
+    def used_columns():
+        return read_efields(paths_efield)
+
+    results = {}
+    reference = None
+    for name, fun in [('pandas_full', pandas_full),
+                      ('read_efields', used_columns)]:
+        efields, seconds = _time(fun, n_repeat)
+        if reference is None:
+            reference = [data[COLUMNS].to_numpy() for data in efields]
+        elif not all(np.array_equal(a, b)
+                     for a, b in zip(reference, efields)):
+            raise Exception('ERROR: %s differs from pandas_full' % name)
+        results[name] = seconds
+        print('%-14s %8.3f sec %8.1f MB/s' %
+              (name, seconds, n_bytes / seconds / 2 ** 20))
+    return results
+
+
+def benchmark_compression(path_dataset, zip_methods=('stored', 'deflated',
+                                                    'lzma'),
+                          png_levels=(None, 1, 6, 9)) -> dict:
+    """
+    Rebuilds the images of a dataset_<msf|sar>.zip with each combination of
+    zip compression method and png compression level (see
+    settings.Compression), and with the raw uint8 pixels ('raw') instead of
+    pngs. Reports per combination the build time, archive size and the
+    read-back throughput (reading and decoding all images).
+    """
+    with ZipFile(path_dataset, 'r') as zipfile:
+        imgs = [np.asarray(Image.open(io.BytesIO(zipfile.read(name))))
+                for name in zipfile.namelist() if name.endswith('.png')]
+    n_bytes = sum(img.nbytes for img in imgs)
+
+    def encode(img, png_level):
+        if png_level == 'raw':
+            return img.tobytes()
+        buffer = io.BytesIO()
+        Image.fromarray(img).save(buffer, **png_kwargs(png_level))
+        return buffer.getvalue()
+
+    def decode(data, png_level, img):
+        if png_level == 'raw':
+            return np.frombuffer(data, dtype=img.dtype).reshape(img.shape)
+        return np.asarray(Image.open(io.BytesIO(data)))
+
+    results = {}
+    print('%-9s %-5s %8s %9s %10s' %
+          ('zip', 'png', 'build', 'size', 'read'))
+    with tempfile.TemporaryDirectory() as path_dir:
+        path = os.path.join(path_dir, 'dataset.zip')
+        for zip_method in zip_methods:
+            for png_level in tuple(png_levels) + ('raw',):
+                # build
+                timer = time()
+                with ZipFile(path, 'w', **zip_kwargs(zip_method)) as zipfile:
+                    for idx, img in enumerate(imgs):
+                        zipfile.writestr('%i' % idx, encode(img, png_level))
+                t_build = time() - timer
+                size = os.path.getsize(path)
+
+                # read back
+                timer = time()
+                with ZipFile(path, 'r') as zipfile:
+                    for idx, img in enumerate(imgs):
+                        decode(zipfile.read('%i' % idx), png_level, img)
+                t_read = time() - timer
+
+                results[(zip_method, png_level)] = {
+                    'build': t_build, 'size': size, 'read': t_read
+                }
+                print('%-9s %-5s %6.2f s %6.1f MB %6.1f MB/s' % (
+                    zip_method, png_level, t_build, size / 2 ** 20,
+                    n_bytes / t_read / 2 ** 20
+                ))
+    return results
+
+
+def benchmark_precision(path_project=None, n_samples: int = 1000,
+                        n_repeat: int = 3, dtypes=('float64', 'float32'),
+                        percentile: float = 99.9, **kwargs) -> dict:
+    """
+    Compares the interpolation and msf synthesis in each precision of
+    dtypes (see settings.MSF.dtype) with the first one (float64), on the
+    given project or else on a synthetic project (kwargs are passed to
+    generate_project). Reports per precision the time of the interpolation
+    and of n_samples msf samples, the memory of the complex fields, the
+    relative error of the msf (relative to the maximum of each sample) and,
+    per bit depth, the fraction of pixels that differ from the float64
+    images and the largest difference. The images are scaled such that the
+    given percentile of the float64 msf maps to the maximum value.
+    """
+    # the interpolation is timed without the cache of the interpolated
+    # e-fields
+    enabled = settings.Cache.enabled
+    settings.Cache.enabled = False
+
+    with tempfile.TemporaryDirectory() as path_dir:
+        if path_project is None:
+            path_project = Path(path_dir).joinpath('project')
+            generate_project(path_project, **kwargs)
+        path_project = Path(path_project)
+        efields = {'efields': read_efields(
+            sorted(list(path_project.glob('e-field*.csv')))
+        )}
+
+        results, reference = {}, None
+        for dtype in dtypes:
+            cfa, t_interpolation = _time(
+                lambda: ComplexFieldPerAntenna(path_project, None, efields,
+                                               dtype), n_repeat
+            )
+            msf = MeanSquareField(cfa)
+            batch, t_msf = _time(
+                lambda: msf.generate_msf_batch(0, n_samples, 0), n_repeat
+            )
+            results[dtype] = {'interpolation': t_interpolation,
+                              'msf': t_msf,
+                              'fields': msf.fields.nbytes}
+            if reference is None:
+                reference = batch.msf
+                scalar = 1 / np.percentile(reference, percentile)
+
+            # error of the msf, relative to the maximum of each sample
+            error = np.abs(batch.msf.astype(np.float64) - reference) / \
+                reference.max(axis=1, keepdims=True)
+            results[dtype]['max_error'] = float(error.max())
+            results[dtype]['mean_error'] = float(error.mean())
+
+            # difference of the quantized images
+            for bit_depth in (8, 16):
+                diff = np.abs(
+                    quantize(batch.msf, scalar, bit_depth).astype(np.int64) -
+                    quantize(reference, scalar, bit_depth)
+                )
+                results[dtype]['pixels_%i' % bit_depth] = \
+                    float(np.mean(diff > 0))
+                results[dtype]['max_diff_%i' % bit_depth] = int(diff.max())
+
+    settings.Cache.enabled = enabled
+
+    print('%-8s %9s %9s %9s %9s %9s %14s %14s' % (
+        'dtype', 'interp', 'msf', 'fields', 'max err', 'mean err',
+        '8-bit diff', '16-bit diff'
+    ))
+    for dtype, result in results.items():
+        print('%-8s %7.4f s %7.4f s %6.1f MB %9.1e %9.1e %7.4f%% (%i) '
+              '%7.4f%% (%i)' % (
+                  dtype, result['interpolation'], result['msf'],
+                  result['fields'] / 2 ** 20, result['max_error'],
+                  result['mean_error'], 100 * result['pixels_8'],
+                  result['max_diff_8'], 100 * result['pixels_16'],
+                  result['max_diff_16']
+              ))
+    return results
+
+
+def benchmark_stages(n_samples: int = 1000, n_repeat: int = 3,
+                     path_results: str = 'benchmark_stages.json',
+                     tolerance: float = 0.2, **kwargs) -> dict:
+    """
+    Times each stage of the tool on a synthetic project (see
+    util.synthetic_project, kwargs are passed to generate_project) with
+    n_samples msf samples: reading the e-fields, interpolating them,
+    generating the msf, stitching and rasterising the dxf model, encoding
+    the msf images as png, writing them to a zip-file and emitting the rows
+    of the dataset.csv.
+
+    The best time of n_repeat runs of each stage is compared with the
+    results in path_results (of a previous run), stages that are more than
+    'tolerance' slower are reported as regressions. The results are then
+    saved in path_results, as reference for the next run.
+    """
+    # the stages are timed without the cache of the interpolated e-fields
+    enabled = settings.Cache.enabled
+    settings.Cache.enabled = False
+
+    results = {}
+    with tempfile.TemporaryDirectory() as path_dir:
+        path_project = Path(path_dir).joinpath('project')
+        materials = generate_project(path_project, **kwargs)
+        paths_efield = sorted(list(path_project.glob('e-field*.csv')))
+        cfa = ComplexFieldPerAntenna(path_project)
+        msf = MeanSquareField(cfa)
+        dxf = DrawingInterchangeFormat(path_project, materials, 0)
+        dxf.mm_per_px = cfa.mm_per_px
+
+        efields, results['csv_load'] = _time(
+            lambda: read_efields(paths_efield), n_repeat
+        )
+
+        def interpolation():
+            x, z = efields[0][:, COL_X], efields[0][:, COL_Z]
+            operator, _ = _interpolation_operator(x, z, cfa.width,
+                                                  cfa.height)
+            values = np.hstack([data[:, (COL_Z + 1):] for data in efields])
+            return (operator @ values).reshape((-1, cfa.na, XYZ, COMPLEX))
+
+        _, results['interpolation'] = _time(interpolation, n_repeat)
+        batch, results['msf'] = _time(
+            lambda: msf.generate_msf_batch(0, n_samples, 0), n_repeat
+        )
+        _, results['dxf'] = _time(dxf._generate_maps, n_repeat)
+        imgs = batch.to_imgs()
+        pngs, results['png_encode'] = _time(
+            lambda: [encode_png(img) for img in imgs], n_repeat
+        )
+
+        path_zip = os.path.join(path_dir, 'dataset.zip')
+
+        def zip_write():
+            with ZipFile(path_zip, 'w', **zip_kwargs()) as zipfile:
+                for filename, png in zip(batch.filenames, pngs):
+                    zipfile.writestr(filename, png)
+
+        _, results['zip_write'] = _time(zip_write, n_repeat)
+
+        cnf = [{'filename': filename,
+                'amplitudes': list(batch.amplitudes[idx]),
+                'phases': list(batch.phases[idx])}
+               for idx, filename in enumerate(batch.filenames)]
+
+        def csv_emit():
+            csv = CSV(os.path.join(path_dir, 'dataset.csv'))
+            for idx, cnf_ in enumerate(cnf):
+                csv.append(cnf_, 'msf', 0, idx)
+            with ZipFile(path_zip, 'w') as zipfile:
+                csv.save(zipfile)
+            csv.close()
+
+        _, results['csv_emit'] = _time(csv_emit, n_repeat)
+
+    settings.Cache.enabled = enabled
+
+    # compare with the results of the previous run
+    previous = {}
+    if os.path.exists(path_results):
+        with open(path_results, 'r') as file:
+            previous = json.load(file)
+    regressions = []
+    print('%-14s %9s %9s' % ('stage', 'time', 'previous'))
+    for stage in STAGES:
+        line = '%-14s %7.4f s' % (stage, results[stage])
+        if stage in previous:
+            line += ' %7.4f s' % previous[stage]
+            if results[stage] > (1 + tolerance) * previous[stage]:
+                regressions.append(stage)
+                line += '  REGRESSION (x%.2f)' % (
+                    results[stage] / previous[stage])
+        print(line)
+
+    with open(path_results, 'w') as file:
+        json.dump(results, file, indent=4)
+    return {'results': results, 'regressions': regressions}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("path", nargs='?',
+                        help="path to a CST project, or to a dataset "
+                             "zip-file with --compression")
+    parser.add_argument("--n_repeat", type=int, default=3)
+    parser.add_argument("--compression", action='store_true',
+                        help="benchmark the compression of a dataset")
+    parser.add_argument("--stages", action='store_true',
+                        help="benchmark each stage on a synthetic project")
+    parser.add_argument("--precision", action='store_true',
+                        help="compare the float32 with the float64 "
+                             "interpolation and msf, on the given or a "
+                             "synthetic project")
+    parser.add_argument("--n_samples", type=int, default=1000)
+    parser.add_argument("--results", default='benchmark_stages.json',
+                        help="results of the previous --stages run")
+    args = parser.parse_args()
+    if args.stages:
+        benchmark_stages(args.n_samples, args.n_repeat, args.results)
+    elif args.precision:
+        benchmark_precision(args.path, args.n_samples, args.n_repeat)
+    elif args.compression:
+        benchmark_compression(args.path)
+    else:
+        benchmark_efield_reader(args.path, args.n_repeat)
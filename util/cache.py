@@ -0,0 +1,91 @@
+import hashlib
+import os
+from pathlib import Path
+from time import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+import settings
+
+
+class Cache:
+    """
+    Persistent on-disk cache of named numpy arrays, stored as one .npz file
+    per key in 'settings.Cache.path'.
+
+    The key is derived from the fingerprints of the source files (path, size
+    and modification time) and any other values the cached result depends
+    on, see 'key'. A cache hit updates the modification time of the file,
+    such that 'evict' removes the least recently used files first once the
+    cache exceeds 'settings.Cache.max_size', and removes files that are not
+    used for more than 'settings.Cache.max_age'.
+    """
+
+    def __init__(self, name: str, path: Optional[str] = None):
+        if path is None:
+            path = settings.Cache.path
+        self.path = Path(path).joinpath(name)
+        self.enabled = settings.Cache.enabled
+
+    @staticmethod
+    def key(paths: List[Path], *args) -> str:
+        sha = hashlib.sha1()
+        for path in paths:
+            stat = os.stat(path)
+            sha.update(('%s;%i;%i\n' % (
+                os.path.abspath(path), stat.st_size, stat.st_mtime_ns
+            )).encode())
+        for arg in args:
+            sha.update(('%r\n' % (arg,)).encode())
+        return sha.hexdigest()
+
+    def load(self, key: str) -> Optional[Dict[str, np.ndarray]]:
+        if not self.enabled:
+            return None
+        path = self.path.joinpath(key + '.npz')
+        try:
+            with np.load(path) as data:
+                arrays = {name: data[name] for name in data.files}
+        except (OSError, ValueError):
+            # the file does not exist or is corrupt
+            return None
+        # mark file as recently used
+        os.utime(path)
+        return arrays
+
+    def save(self, key: str, **arrays) -> None:
+        if not self.enabled:
+            return
+        # write to a temporary file first, such that other processes never
+        # load a partially written file
+        self.path.mkdir(parents=True, exist_ok=True)
+        path = self.path.joinpath(key + '.npz')
+        path_tmp = self.path.joinpath('%s.%i.tmp.npz' % (key, os.getpid()))
+        np.savez(path_tmp, **arrays)
+        os.replace(path_tmp, path)
+        self.evict()
+
+    def evict(self) -> None:
+        # obtain the size and last usage of each file in the cache
+        files = []
+        for entry in os.scandir(self.path):
+            if entry.name.endswith('.tmp.npz'):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                # removed by another process
+                continue
+            files.append((stat.st_mtime, stat.st_size, entry.path))
+
+        # remove the files that are not used for too long, and the least
+        # recently used files while the cache is too large
+        files.sort()
+        size = sum(file[1] for file in files)
+        for mtime, size_file, path in files:
+            if time() - mtime < settings.Cache.max_age and \
+                    size <= settings.Cache.max_size:
+                break
+            Path(path).unlink(missing_ok=True)
+            size -= size_file
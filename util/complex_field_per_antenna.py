@@ -1,8 +1,11 @@
+import hashlib
+
 import numpy as np
 import pandas as pd
-import scipy.interpolate
+import scipy.sparse
 
 import settings
+from .cache import Cache
 
 REAL = 0
 IMAG = 1
@@ -15,82 +18,176 @@ LABELS = [['ExRe [V/m]', 'ExIm [V/m]'],
           ['EyRe [V/m]', 'EyIm [V/m]'],
           ['EzRe [V/m]', 'EzIm [V/m]']]
 
+# columns that are read from an exported e-field, in this order
+COLUMNS = ['#x [mm]', 'z [mm]'] + [label for labels in LABELS
+                                   for label in labels]
+COL_X = 0
+COL_Z = 1
+
+# interpolation operators, per source grid and resolution
+_operators = {}
+MAX_OPERATORS = 8
+
 
 class ComplexFieldPerAntenna:
     """
     This object loads the Complex electric Field of each Antenna (cfa) and
-    interpolates it to the Img.width and Img.height resolution as defined in
-    the settings file. Furthermore, the meshgrid points (xx, zz), unique
-    points (x, z), and pixel-size (mm_per_px) are also determined.
+    interpolates it to the given resolution (width, height), by default
+    Img.width and Img.height as defined in the settings file. Furthermore,
+    the meshgrid points (xx, zz), unique points (x, z), and pixel-size
+    (mm_per_px) are also determined.
+
+    The e-fields that are read from the project are kept in 'efields' if
+    given, such that other objects of the same project (e.g. of another
+    resolution) can reuse them.
+
+    The e-fields are interpolated in the precision 'dtype' (by default
+    settings.MSF.dtype), which is also the dtype of the cfa.
     """
 
-    def __init__(self, path_project):
+    def __init__(self, path_project, resolution=None, efields=None,
+                 dtype=None):
 
         # get e-fields in project folder
         paths_efield = sorted(list(path_project.glob('e-field*.csv')))
 
+        # name of the project, which identifies it
+        self.name = path_project.name
+
         # number of antenna's
         self.na = len(paths_efield)
 
-        # pre-allocate space for cfa
-        self.cfa = np.zeros((
-            settings.Imgs.width * settings.Imgs.height,
-            self.na,
-            XYZ,
-            COMPLEX
-        ))
-
-        # loop through exported e-field per antenna
-        points_old, points_new, size_old = None, None, None
-        for idx, path_efield in enumerate(paths_efield):
-
-            # read e-field into a pandas DataFrame
-            data = pd.read_csv(path_efield, delimiter=';')
-
-            # determine interpolation points
-            if idx == 0:
-                points_old, points_new, size_old = \
-                    _interpolation_points(data)
-
-            # interpolate data to desired resolution
-            for dim in range(XYZ):
-                for unit in range(COMPLEX):
-                    self.cfa[:, idx, dim, unit] = _interpolate(
-                        data[LABELS[dim][unit]].values.reshape(size_old),
-                        points_old,
-                        points_new
-                    )
+        # resolution of the interpolated e-fields
+        if resolution is None:
+            resolution = (settings.Imgs.width, settings.Imgs.height)
+        self.width, self.height = resolution
+
+        # precision of the interpolation
+        self.dtype = np.dtype(settings.MSF.dtype if dtype is None else dtype)
+
+        # load the interpolated e-fields from the cache, which is keyed on
+        # the e-field files, the resolution and the precision
+        cache = Cache('cfa')
+        key = cache.key(paths_efield, self.width, self.height,
+                        self.dtype.str)
+        cached = cache.load(key)
+        if cached is None:
+            if efields is None:
+                efields = {}
+            if 'efields' not in efields:
+                efields['efields'] = read_efields(paths_efield)
+            self.cfa, xx, zz = self._load(efields['efields'])
+            cache.save(key, cfa=self.cfa, xx=xx, zz=zz)
+        else:
+            self.cfa, xx, zz = cached['cfa'], cached['xx'], cached['zz']
 
         # set attributes
-        self.xx = points_new[0]
-        self.zz = points_new[1]
+        self.xx = xx
+        self.zz = zz
         self.np = len(self.xx)
         self.x = np.unique(self.xx)
         self.z = np.unique(self.zz)
         self.mm_per_px = [self.x[1] - self.x[0],
                           self.z[1] - self.z[0]]
 
+    def _load(self, efields):
+
+        # every antenna is exported on the same grid, the interpolation
+        # operator is therefore determined once
+        x, z = efields[0][:, COL_X], efields[0][:, COL_Z]
+        for data in efields[1:]:
+            if not (np.array_equal(data[:, COL_X], x) and
+                    np.array_equal(data[:, COL_Z], z)):
+                raise Exception('ERROR: e-fields are not exported on the '
+                                'same grid')
+        operator, points_new = interpolation_operator(
+            x, z, self.width, self.height
+        )
+
+        # interpolate all antennas and components at once, the columns are
+        # [antenna 0: ExRe, ExIm, EyRe, ..., antenna 1: ExRe, ...]
+        values = np.hstack([data[:, (COL_Z + 1):] for data in efields])
+        cfa = (operator.astype(self.dtype) @ values.astype(self.dtype))
+        cfa = cfa.reshape((-1, self.na, XYZ, COMPLEX))
+
+        return cfa, points_new[0], points_new[1]
 
-def _interpolation_points(data: pd.DataFrame):
-    points_old = (np.unique(data['#x [mm]'].values),
-                  np.unique(data['z [mm]'].values))
-    points_new = _generate_xz(
-        settings.Imgs.width,
-        settings.Imgs.height,
-        (data['#x [mm]'].min(), data['#x [mm]'].max()),
-        (data['z [mm]'].min(), data['z [mm]'].max())
-    )
-    size_old = (len(np.unique(points_old[0])),
-                len(np.unique(points_old[1])))
-    return points_old, points_new, size_old
 
+def read_efield(path_efield) -> np.ndarray:
+    """
+    Reads only the x, z and complex e-field columns of an exported e-field.
+    Returns an ndarray of shape [n_points, len(COLUMNS)], with the columns in
+    the order of COLUMNS.
+    """
+    data = pd.read_csv(path_efield, delimiter=';', usecols=COLUMNS,
+                       dtype=np.float64, engine='c')
+    return data[COLUMNS].to_numpy()
+
+
+def read_efields(paths_efield) -> list:
+    # read the exported e-field of each antenna
+    return [read_efield(path_efield) for path_efield in paths_efield]
+
+
+def interpolation_operator(x, z, width, height):
+    """
+    Returns the sparse matrix that bilinearly interpolates values on the
+    (regular) source grid, with the points (x, z) in the order of an exported
+    e-field, to a width x height grid. The interpolated points (xx, zz) are
+    returned as well.
+
+    The operator only depends on the source grid and the resolution, it is
+    therefore reused for each project with the same grid.
+    """
+    key = (hashlib.sha1(x.tobytes() + z.tobytes()).hexdigest(),
+           width, height)
+    if key not in _operators:
+        # keep a limited number of operators
+        if len(_operators) >= MAX_OPERATORS:
+            del _operators[next(iter(_operators))]
+        _operators[key] = _interpolation_operator(x, z, width, height)
+    return _operators[key]
+
+
+def _interpolation_operator(x, z, width, height):
+    # source grid, the values of the exported e-field are ordered by x
+    # first, i.e. value (ix, iz) is at row ix * nz + iz
+    x_old, z_old = np.unique(x), np.unique(z)
+    nz_old = len(z_old)
+
+    # target grid, as flattened meshgrid, i.e. point (ix, iz) is at row
+    # iz * width + ix
+    points_new = _generate_xz(width, height,
+                              (x.min(), x.max()), (z.min(), z.max()))
+
+    # index of the lower grid point and the weight of the upper grid point
+    ix, wx = _bilinear_weights(x_old, points_new[0])
+    iz, wz = _bilinear_weights(z_old, points_new[1])
+
+    # each interpolated point is a weighted sum of the 4 surrounding points
+    rows = np.repeat(np.arange(len(points_new[0])), 4)
+    cols = np.stack([ix * nz_old + iz,
+                     (ix + 1) * nz_old + iz,
+                     ix * nz_old + iz + 1,
+                     (ix + 1) * nz_old + iz + 1], axis=1).reshape(-1)
+    weights = np.stack([(1 - wx) * (1 - wz),
+                        wx * (1 - wz),
+                        (1 - wx) * wz,
+                        wx * wz], axis=1).reshape(-1)
+    operator = scipy.sparse.csr_matrix(
+        (weights, (rows, cols)),
+        shape=(len(points_new[0]), len(x_old) * nz_old)
+    )
+    return operator, points_new
 
-def _interpolate(data, points_old, points_new):
-    # interpolation function
-    interpol = scipy.interpolate.RegularGridInterpolator(points_old, data)
 
-    # apply interpolation and return result
-    return interpol(points_new).reshape(-1)
+def _bilinear_weights(grid, points):
+    # index of the grid interval of each point, and the relative position of
+    # the point in that interval
+    idx = np.searchsorted(grid, points) - 1
+    idx = np.clip(idx, 0, len(grid) - 2)
+    weight = (points - grid[idx]) / (grid[idx + 1] - grid[idx])
+    return idx, weight
 
 
 def _generate_xz(nx, nz, x_lim, z_lim):
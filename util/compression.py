@@ -0,0 +1,46 @@
+import io
+from zipfile import ZIP_BZIP2, ZIP_DEFLATED, ZIP_LZMA, ZIP_STORED
+
+from PIL import Image
+
+import settings
+
+# zip compression methods by name, as used in settings.Compression
+ZIP_METHODS = {
+    'stored': ZIP_STORED,
+    'deflated': ZIP_DEFLATED,
+    'bzip2': ZIP_BZIP2,
+    'lzma': ZIP_LZMA,
+}
+
+
+def zip_kwargs(method: str = None, level: int = None) -> dict:
+    """
+    Returns the compression arguments of a ZipFile, by default as defined in
+    settings.Compression.
+    """
+    if method is None:
+        method = settings.Compression.zip_method
+        level = settings.Compression.zip_level
+    return {'compression': ZIP_METHODS[method], 'compresslevel': level}
+
+
+def png_kwargs(level: int = None) -> dict:
+    """
+    Returns the arguments of PIL's Image.save to save a png, by default with
+    the compression level defined in settings.Compression (PIL's default
+    level if that is None).
+    """
+    if level is None:
+        level = settings.Compression.png_level
+    kwargs = {'format': 'png'}
+    if level is not None:
+        kwargs['compress_level'] = level
+    return kwargs
+
+
+def recompress_png(data: bytes) -> bytes:
+    # re-encode a png with the compression level of settings.Compression
+    buffer = io.BytesIO()
+    Image.open(io.BytesIO(data)).save(buffer, **png_kwargs())
+    return buffer.getvalue()
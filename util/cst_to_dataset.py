@@ -1,163 +1,590 @@
+import io
 import json
+import os
 from pathlib import Path
-from time import time
-from typing import List
-from zipfile import ZipFile
+from functools import partial
+from time import perf_counter, time
+from multiprocessing import Pool
+from typing import Dict, List, Optional, Tuple
+from zipfile import ZipFile, ZipInfo
 
 import numpy as np
 from numpy import pi
+from PIL import Image
 
 import settings as settings
+from .compression import recompress_png, zip_kwargs
+from .discovery import (MAPS, discover_projects, fingerprint, output_paths,
+                        project_size, zip_info)
+from .manifest import Archive, Manifest
+from .mean_squared_field import rng_metadata
+from .memory import imap_bounded, peak_rss
+from .metrics import Metrics
+from .npy_shards import ShardWriter
+from .png_pipeline import PNGWriter
 from .print import Print
+from .statistics import (Statistics, from_dicts, image_edges, merge_all,
+                         to_dicts)
 
 MAX_PROJECTS = 3200
-MAX_SAMPLES_PER_PROJECT = 3200
+DATASETS = ['msf', 'sar']
 
 
-def cst_to_dataset(partition_id: int):
+def cst_to_dataset(partition_id: int,
+                   n_partitions: int = settings.Partitions.n,
+                   n_processes: int = settings.Parallel.n_processes,
+                   resume: bool = settings.Manifest.resume):
     """
     Converts the data generated in CST to a zipped PyTorch dataset.
+
+    The (sorted) projects are split into 'n_partitions' contiguous shards,
+    only the shard with the given 'partition_id' is converted. Each shard is
+    saved to its own dataset_<msf|sar>_<partition_id>.zip, these can be
+    combined afterwards with util.merge_datasets.merge_datasets.
+
+    The projects are loaded by 'n_processes' worker processes, the dataset
+    itself is written by the main process only. Setting 'n_processes' to 1
+    loads the projects serially, the resulting dataset is identical.
+
+    Progress is recorded in manifest<_partition_id>.json at each checkpoint
+    (see util.manifest). If 'resume' is True, a previous (crashed or
+    finished) build is continued: projects that are unchanged since they
+    were added are skipped, only new or modified projects are appended.
+
+    If settings.Statistics.enabled, the statistics of each input channel
+    and of the output images of each project are recorded in the manifest.
+    The statistics of the projects in the dataset (i.e. without the stale
+    images) are merged into the metadata.json of each dataset (see
+    util.statistics), without the histograms if images are stale.
     """
 
     # start main timer
     timer = time()
 
-    # create print object which logs the print messages to a log.txt file
-    print_ = Print('log.txt', partition_id).log
-
-    # create msf and sar dataset
-    for dataset in ['msf', 'sar']:
-
-        # create dataset
-        zipfile = ZipFile('dataset_%s.zip' % dataset, 'w')
-
-        # counters to keep track of input/output images
-        cnt_in = 0  # counter of input imgs
-        cnt_out = 0  # counter of output imgs
-
-        # path to each project that is to be added to the dataset
-        paths_project = list(Path(settings.Paths.src).iterdir())
-
-        # get the ids of the valid projects
-        ids_valid = []
-        for idx_project, path_project in enumerate(paths_project):
-            # remember idx if results exist
-            if path_project.joinpath('e-field 11.csv').exists():
-                ids_valid.append(idx_project)
-
-        # limit the number of projects to MAX_PROJECTS
-        if len(ids_valid) > MAX_PROJECTS:
-            ids_valid = ids_valid[0:(MAX_PROJECTS - 1)]
-        n_projects = len(ids_valid)
-
-        # get the valid project paths
-        paths_valid_project = []
-        for idx in ids_valid:
-            paths_valid_project.append(paths_project[idx])
-
-        # initialize csv file object
-        csv = CSV(n_projects)
+    # suffix of the files that are created, such that the partitions do not
+    # overwrite each others files
+    suffix = '' if n_partitions == 1 else '_%i' % partition_id
 
-        # loop through each project
-        for idx_project, path_project in enumerate(paths_valid_project):
+    # create print object which logs the print messages to a log.txt file
+    log = Print('log%s.txt' % suffix, partition_id)
+    print_ = log.log
+
+    # load the manifest of the previous build, if it is to be resumed
+    manifest = Manifest('manifest%s.json' % suffix, DATASETS)
+    if resume:
+        manifest.load()
+
+    # create (or restore the last checkpoint of) the msf and sar dataset,
+    # both are filled in a single pass through the projects, such that each
+    # project (and input image) is read once. The rows of each dataset.csv
+    # are kept in a separate csv file until the dataset is finished. The
+    # images are written to each archive by a writer thread, concurrently
+    # with the loop over the projects.
+    archives, writers, csvs = {}, {}, {}
+    for dataset in DATASETS:
+        checkpoint = manifest.checkpoint.get(dataset)
+        archives[dataset] = Archive(
+            'dataset_%s%s.zip' % (dataset, suffix), checkpoint
+        )
+        writers[dataset] = PNGWriter(archives[dataset].zipfile,
+                                     settings.Parallel.n_threads_png)
+        csvs[dataset] = CSV(
+            'dataset_%s%s.csv' % (dataset, suffix),
+            0 if checkpoint is None else checkpoint['csv']
+        )
 
-            # log
-            print_('importing project (%i/%i)...' %
-                  (idx_project + 1, n_projects))
-            print_('\t%s ' % str(path_project))
+    # create (or restore) the .npy shards of the inputs and outputs
+    shards = {}
+    if settings.Output.npy:
+        for dataset in DATASETS:
+            checkpoint = manifest.checkpoint.get(dataset, {})
+            if checkpoint and 'npy' not in checkpoint:
+                raise Exception('ERROR: the previous build has no npy '
+                                'output, the dataset needs to be rebuilt')
+            shards[dataset] = {
+                key: ShardWriter(
+                    'dataset_%s%s/%s' % (dataset, suffix, key),
+                    settings.Output.shard_size[key],
+                    checkpoint.get('npy', {}).get(key)
+                ) for key in ['input', 'output']
+            }
+
+    # counters to keep track of input/output images
+    cnt_in = manifest.cnt_in  # counter of input imgs
+    cnt_out = manifest.cnt_out.copy()  # counter of output imgs
+
+    # scan the projects once (sorted, such that each partition obtains the
+    # same order), the later stages use the resulting index
+    projects, invalid = discover_projects(settings.Paths.src)
+    n_unfinished = 0
+    for name, reason in invalid.items():
+        if reason.startswith('simulation is not finished'):
+            n_unfinished += 1
+            print_('skipping project %s, %s' % (name, reason))
+        else:
+            print_('WARNING: skipping project %s, %s' % (name, reason))
+    print_('%i valid projects, %i unfinished, %i invalid' % (
+        len(projects), n_unfinished, len(invalid) - n_unfinished
+    ))
+
+    # limit the number of projects to MAX_PROJECTS
+    if len(projects) > MAX_PROJECTS:
+        projects = projects[0:(MAX_PROJECTS - 1)]
+
+    # only keep the projects of this partition
+    projects = partition(projects, partition_id, n_partitions)
+    n_projects = len(projects)
+
+    # skip the projects that are unchanged since the previous build
+    fingerprints = [fingerprint(project) for project in projects]
+    ids_todo = manifest.update(
+        [project['name'] for project in projects],
+        fingerprints
+    )
+    print_('%i of %i projects are up to date' %
+           (n_projects - len(ids_todo), n_projects))
+    projects = [projects[idx] for idx in ids_todo]
+    fingerprints = [fingerprints[idx] for idx in ids_todo]
+    n_projects = len(ids_todo)
+
+    # either use a pool of worker processes or load the projects serially,
+    # there is no pool if there are no projects to load
+    pool = None
+    if n_processes > 1 and n_projects > 0:
+        pool = Pool(n_processes)
+
+    # metrics of each stage, per project and in total
+    metrics = Metrics('metrics%s.jsonl' % suffix, n_projects)
+
+    def checkpoint():
+        # save the state of each archive & csv together with the manifest
+        for dataset_ in DATASETS:
+            # the checkpoint reopens the zip-file, once the images are written
+            writers[dataset_].flush()
+            manifest.checkpoint[dataset_] = archives[dataset_].checkpoint()
+            writers[dataset_].zipfile = archives[dataset_].zipfile
+            manifest.checkpoint[dataset_]['csv'] = csvs[dataset_].flush()
+            if dataset_ in shards:
+                manifest.checkpoint[dataset_]['npy'] = {
+                    key: list(writer.checkpoint(
+                        manifest.stale[dataset_] if key == 'output' else None
+                    )) for key, writer in shards[dataset_].items()
+                }
+        manifest.cnt_in = cnt_in
+        manifest.cnt_out = cnt_out.copy()
+        manifest.save()
+        for dataset_ in DATASETS:
+            archives[dataset_].remove_old_tails()
+        print_('checkpoint saved')
+        return time()
+
+    # load the projects. The results are returned in project order, such that
+    # cnt_in and cnt_out are assigned the same as in a serial run. The
+    # workers only load ahead as long as the loaded projects fit in
+    # settings.Memory.budget.
+    load = partial(_load_project, decode=settings.Output.npy,
+                   statistics=settings.Statistics.enabled)
+    if pool is None:
+        loaded = map(load, projects)
+    else:
+        loaded = imap_bounded(
+            pool, load, projects,
+            [project_size(project, settings.Output.npy)
+             for project in projects],
+            settings.Memory.budget
+        )
+    timer_checkpoint = time()
+
+    # loop through each project
+    for idx_project, (project_index, project) in enumerate(
+            zip(projects, metrics.timed(loaded, 'load'))):
+        metrics.add('read', *project['metrics'])
+
+        # log
+        print_('importing project (%i/%i)...' %
+               (idx_project + 1, n_projects))
+        print_('\t%s ' % project_index['path'])
+        for dataset, unused in project['unused_cnf'].items():
+            if unused:
+                print_('\tWARNING: %i %s configuration(s) without output: %s'
+                       % (len(unused), dataset, ', '.join(unused)))
+        if project['rng'] is not None and project['rng'] != rng_metadata():
+            print_('\tWARNING: the samples of the project are drawn by '
+                   'other random generators (rng.json) than recorded in the '
+                   'metadata.json of the msf dataset')
+
+        for dataset in DATASETS:
+            writer = writers[dataset]
 
             # add input images to dataset
-            print_('\tadding input images...')
-            for img in ['conductivity', 'density', 'model', 'permittivity']:
-                src = path_project.joinpath('maps', img + '.png')
+            print_('\tadding input images to %s dataset...' % dataset)
+            for img, staged in project['inputs'].items():
                 dst = 'input/%s_%04i.png' % (img, cnt_in)
-                zipfile.write(src, dst)
+                with metrics.stage('write', 1, len(staged[1])):
+                    writer.submit_staged(dst, staged)
+            if dataset in shards:
+                with metrics.stage('npy', 1):
+                    shards[dataset]['input'].append(
+                        **project['arrays']['inputs']
+                    )
             print_('\t\t...done')
 
-            # get the path to each output image
-            paths_output = sorted(list(
-                path_project.joinpath(dataset).glob('*.png')
-            ))
-
-            # read the antenna configuration file
-            pth_cnf = path_project.joinpath('%s/configuration.json' % dataset)
-            with open(pth_cnf, 'r') as file:
-                cnf = json.load(file)
-
             # add each output image to the dataset
-            print_('\tadding output images...')
-            n_outputs = len(list(paths_output))
-            pct = 0
+            print_('\tadding output images to %s dataset...' % dataset)
+            outputs = project['outputs'][dataset]
+            n_outputs = len(outputs)
+            pct_next = 0
             pct_step = 10
             timer2 = time()
-            timer3_ = 0.
-            timer4_ = 0.
-            timer5_ = 0.
-            for idx, src in enumerate(paths_output):
-                if idx % (n_outputs / (100 / pct_step)) == 0:
+            for idx, (cnf_idx, staged) in enumerate(outputs):
+                # log each step of pct_step percent that is reached
+                pct = 100 * idx // n_outputs // pct_step * pct_step
+                if pct >= pct_next:
                     print_('\t\t%i%% (%.2f sec)' % (pct, time() - timer2))
-                    # print('\t\t\tCnf: %.2f sec' % timer3_)
-                    # print('\t\t\tCSV: %.2f sec' % timer4_)
-                    # print('\t\t\tWrit: %.2f sec' % timer5_)
                     timer2 = time()
-                    timer3_ = 0.
-                    timer4_ = 0.
-                    timer5_ = 0.
-                    pct += pct_step
-
-                dst = 'output/%s_%07i.png' % (dataset, cnt_out)
-
-                # timer3 = time()
-                cnf, cnf_idx = get_cnf(cnf, src)
-                # timer3_ += time() - timer3
-                #
-                # timer4 = time()
-                csv.append(cnf_idx, dataset, cnt_in, cnt_out)
-                # timer4_ += time() - timer4
-                #
-                # timer5 = time()
-                zipfile.write(src, dst)
-                # timer5_ += time() - timer5
+                    pct_next = pct + pct_step
+
+                dst = 'output/%s_%07i.png' % (dataset, cnt_out[dataset])
+
+                with metrics.stage('csv', 1):
+                    csvs[dataset].append(cnf_idx, dataset, cnt_in,
+                                         cnt_out[dataset])
+                with metrics.stage('write', 1, len(staged[1])):
+                    writer.submit_staged(dst, staged)
+                if dataset in shards:
+                    with metrics.stage('npy', 1):
+                        shards[dataset]['output'].append(
+                            output=project['arrays']['outputs'][dataset][idx],
+                            parameters=parameters(cnf_idx),
+                            input=cnt_in
+                        )
 
                 # update counter for output images
-                cnt_out += 1
+                cnt_out[dataset] += 1
 
             print_('\t\t100%')
             print_('\t\t...done')
 
-            # update counter for input images
-            cnt_in += 1
+        # record the project (and the statistics of its images) in the
+        # manifest
+        manifest.add(
+            project_index['name'],
+            fingerprints[idx_project],
+            cnt_in,
+            {dataset: [cnt_out[dataset] - len(project['outputs'][dataset]),
+                       cnt_out[dataset]] for dataset in DATASETS},
+            project['statistics']
+        )
 
-        # add csv to dataset
-        print_('adding dataset.csv...')
-        zipfile.writestr('dataset.csv', csv())
+        # update counter for input images
+        cnt_in += 1
+
+        # save a checkpoint regularly
+        if time() - timer_checkpoint > settings.Manifest.checkpoint_interval:
+            with metrics.stage('checkpoint'):
+                timer_checkpoint = checkpoint()
+
+        # log the throughput regularly
+        progress = metrics.end_project(project_index['name'])
+        if progress is not None:
+            print_(progress)
+
+    # save the final checkpoint, which excludes the dataset.csv
+    with metrics.stage('checkpoint'):
+        checkpoint()
+    for dataset in DATASETS:
+        writers[dataset].close()
+
+    # stop the worker processes
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    # add csv and metadata to datasets
+    for dataset in DATASETS:
+        print_('adding dataset.csv to %s dataset...' % dataset)
+        with metrics.stage('csv'):
+            csvs[dataset].save(archives[dataset].zipfile,
+                               manifest.stale_ids(dataset))
+        statistics = None
+        if settings.Statistics.enabled:
+            with metrics.stage('statistics'):
+                statistics = dataset_statistics(manifest, dataset)
+            if statistics is None:
+                print_('WARNING: not all projects of the %s dataset have '
+                       'statistics (rebuild the dataset to obtain them), '
+                       'these are left out of the metadata' % dataset)
+            elif manifest.stale[dataset]:
+                print_('WARNING: the %s dataset has stale images, the '
+                       'histograms are left out of the metadata (rebuild the '
+                       'dataset to obtain them)' % dataset)
+        archives[dataset].zipfile.writestr(
+            'metadata.json',
+            json.dumps(metadata(dataset, statistics), indent=4)
+        )
+        csvs[dataset].close()
+        archives[dataset].close()
         print_('\t...done')
 
+    # report the size of the archives and the build time
+    for dataset in DATASETS:
+        path = 'dataset_%s%s.zip' % (dataset, suffix)
+        print_('%s: %.1f MB (zip: %s, png: %s)' % (
+            path, os.path.getsize(path) / 2 ** 20,
+            settings.Compression.zip_method, settings.Compression.png_level
+        ))
+    print_('build time: %.1f sec' % (time() - timer))
+
+    # report the peak memory usage, such that the memory of the job can be
+    # chosen accordingly. Without a pool, the child processes are only the
+    # commands of the system info, which are not reported.
+    rss = {'main': peak_rss()}
+    if pool is not None:
+        rss['worker'] = peak_rss(children=True)
+    if rss['main'] is not None:
+        line = 'peak memory: %.0f MB (main process)' % (rss['main'] / 2 ** 20)
+        if 'worker' in rss:
+            line += ', %.0f MB (largest worker)' % (rss['worker'] / 2 ** 20)
+        print_(line)
+    metrics.close(peak_rss=rss)
+    log.close()
+
+
+def metadata(dataset: str,
+             statistics: Dict[str, Statistics] = None) -> dict:
+    # metadata of the dataset, e.g. the statistics of each channel and, for
+    # the msf dataset, how the random numbers of the samples are drawn from
+    # the root seed (see rng_metadata). Projects that record their own
+    # (rng.json) are checked against it when they are added.
+    data = {'dataset': dataset}
+    if dataset == 'msf':
+        data['rng'] = rng_metadata()
+    if statistics:
+        data['statistics'] = to_dicts(statistics)
+    return data
+
+
+def dataset_statistics(manifest: Manifest, dataset: str
+                       ) -> Optional[Dict[str, Statistics]]:
+    """
+    Merges the statistics of the projects in the manifest, i.e. of the
+    images in the dataset.csv (without the stale images), in the order in
+    which the projects were added. Returns None if a project has no
+    statistics, e.g. since it was added without settings.Statistics.
+
+    The manifest keeps the histograms merged over all projects that were
+    added, these are only those of the dataset as long as no images are
+    stale. Otherwise, the statistics have no histograms.
+    """
+    projects = sorted(manifest.projects.values(),
+                      key=lambda project: project['cnt_in'])
+    if any(project.get('statistics') is None for project in projects):
+        return None
+    if not manifest.stale[dataset] and \
+            manifest.statistics[dataset] is not None:
+        return from_dicts(manifest.statistics[dataset])
+
+    statistics = {}
+    for project in projects:
+        merge_all(statistics, {
+            **from_dicts(project['statistics']['inputs']),
+            'output': Statistics.from_dict(
+                project['statistics']['outputs'][dataset]
+            )
+        })
+    return statistics
+
+
+def partition(items: list, partition_id: int, n_partitions: int) -> list:
+    """
+    Returns the contiguous shard 'partition_id' out of 'n_partitions' of the
+    given items. The shard sizes differ at most by 1, the shards concatenated
+    in order of their partition id are equal to the given items.
+    """
+    if not 0 <= partition_id < n_partitions:
+        raise Exception('ERROR: partition id %i is not in range [0, %i)' %
+                        (partition_id, n_partitions))
+    n, remainder = divmod(len(items), n_partitions)
+    start = partition_id * n + min(partition_id, remainder)
+    stop = start + n + (1 if partition_id < remainder else 0)
+    return items[start:stop]
+
+
+def _load_project(project: dict, decode: bool = False,
+                  statistics: bool = False) -> dict:
+    """
+    Reads the input and output images (of each dataset) of a single project,
+    as listed in its index (see util.discovery), and matches each output
+    image with its configuration. This is executed by the worker processes,
+    the images are only staged in memory and written to the datasets by the
+    main process. If 'decode' is True, the images are also decoded into
+    arrays (for the .npy shards). If 'statistics' is True, the statistics
+    of each input image (channel 'input/<img>') and of the output images of
+    each dataset are returned as well. The rng.json of the project, if any,
+    is returned as 'rng'. The time it took, the number of images and their
+    size are returned as 'metrics'.
+    """
+    timer = perf_counter()
+
+    # read the input images
+    path_project = Path(project['path'])
+    inputs = {}
+    for img in MAPS:
+        inputs[img] = _stage(path_project.joinpath('maps', img + '.png'),
+                             zip_info(project, 'maps', img + '.png'))
+
+    outputs, unused = {}, {}
+    for dataset in DATASETS:
+
+        # get the path to each output image
+        paths_output = [Path(path) for path in output_paths(project, dataset)]
+
+        # read the antenna configuration file
+        pth_cnf = path_project.joinpath('%s/configuration.json' % dataset)
+        with open(pth_cnf, 'r') as file:
+            cnf = json.load(file)
+
+        # match each output image with its configuration
+        cnfs, unused[dataset] = match_cnf(cnf, paths_output)
+
+        # read each output image
+        outputs[dataset] = []
+        for src, cnf_idx in zip(paths_output, cnfs):
+            outputs[dataset].append((cnf_idx, _stage(
+                src, zip_info(project, dataset, src.name)
+            )))
+
+    # decode the images
+    arrays = None
+    if decode or statistics:
+        arrays = {
+            'inputs': {img: _decode(staged) for img, staged in inputs.items()},
+            'outputs': {dataset: [_decode(staged) for _, staged in outputs_]
+                        for dataset, outputs_ in outputs.items()}
+        }
+
+    # statistics of the images of the project
+    statistics_ = None
+    if statistics:
+        statistics_ = {'inputs': {}, 'outputs': {}}
+        for img, array in arrays['inputs'].items():
+            statistics_['inputs']['input/' + img] = \
+                Statistics(image_edges(array))
+            statistics_['inputs']['input/' + img].update(array)
+        for dataset, arrays_ in arrays['outputs'].items():
+            statistics_['outputs'][dataset] = \
+                Statistics(image_edges(arrays_[0]))
+            for array in arrays_:
+                statistics_['outputs'][dataset].update(array)
+    if not decode:
+        arrays = None
+
+    # how the random numbers of the samples are drawn, if the project
+    # records it (e.g. the synthetic projects)
+    rng = None
+    try:
+        with open(path_project.joinpath('rng.json'), 'r') as file:
+            rng = json.load(file)
+    except FileNotFoundError:
+        pass
+
+    staged = list(inputs.values()) + [staged for outputs_ in outputs.values()
+                                      for _, staged in outputs_]
+    metrics = (perf_counter() - timer, len(staged),
+               sum(len(data) for _, data in staged))
+
+    return {'inputs': inputs, 'outputs': outputs, 'unused_cnf': unused,
+            'rng': rng, 'arrays': arrays, 'statistics': statistics_,
+            'metrics': metrics}
+
+
+def _stage(src, zinfo: ZipInfo) -> Tuple[ZipInfo, bytes]:
+    # read file, its zip info (timestamp, permissions, size) is obtained
+    # from the project index, such that writing it results in the same
+    # archive as ZipFile.write(src, ...)
+    with open(src, 'rb') as file:
+        data = file.read()
+    # re-encode pngs if a compression level is set
+    if settings.Compression.png_level is not None:
+        data = recompress_png(data)
+    return zinfo, data
+
+
+def _decode(staged: Tuple[ZipInfo, bytes]) -> np.ndarray:
+    return np.asarray(Image.open(io.BytesIO(staged[1])))
+
+
+def parameters(cnf: dict) -> np.ndarray:
+    # amplitudes and normalized phases, in the order of the dataset.csv
+    n_antennas = CSV.n_antennas
+    params = np.empty(2 * n_antennas)
+    params[0::2] = cnf['amplitudes'][:n_antennas]
+    params[1::2] = np.asarray(cnf['phases'][:n_antennas]) / 2 / pi
+    return params
+
+
+def index_cnf(cnf: List[dict]) -> Tuple[Dict[str, dict], List[str]]:
+    """
+    Indexes the configuration by the stem of its filename. If a stem occurs
+    more than once, the first entry is used and the filenames of the other
+    entries are returned as duplicates.
+    """
+    index, duplicates = {}, []
+    for cnf_ in cnf:
+        stem = Path(cnf_['filename']).stem
+        if stem in index:
+            duplicates.append(cnf_['filename'])
+        else:
+            index[stem] = cnf_
+    return index, duplicates
+
+
+def match_cnf(cnf: List[dict], paths_output) -> Tuple[List[dict], List[str]]:
+    """
+    Returns the configuration of each output image, together with the
+    filenames of the configuration entries without an output image. Raises
+    an exception listing every output image without a configuration entry.
+    """
+    index, unused = index_cnf(cnf)
+
+    # obtain the configuration of each output image
+    cnfs, missing = [], []
+    for src in paths_output:
+        cnf_ = index.pop(src.stem, None)
+        if cnf_ is None:
+            missing.append(str(src))
+        cnfs.append(cnf_)
 
-def get_cnf(cnf, src) -> [List[dict], dict]:
-    # obtain the configuration of the given source
-    src_name = Path(src).stem
-    for idx in range(len(cnf)):
-        if src_name == Path(cnf[idx]['filename']).stem:
-            cnf_ = cnf[idx].copy()
-            del cnf[idx]
-            return cnf, cnf_
-    # configuration with given source is not found, return empty dict
-    raise Exception('ERROR: configuration with given filename not found')
+    # configuration with given source is not found
+    if missing:
+        raise Exception('ERROR: configuration with given filename not found '
+                        'for %i output(s):\n\t%s' %
+                        (len(missing), '\n\t'.join(missing)))
+
+    # remaining entries do not have an output image
+    unused.extend(cnf_['filename'] for cnf_ in index.values())
+    return cnfs, unused
 
 
 class CSV:
+    """
+    The rows of the dataset.csv are appended to a csv file as they are
+    produced, such that the memory usage does not grow with the size of the
+    dataset. The file is kept next to the dataset, such that the build can
+    be resumed (see util.manifest). 'save' copies the rows into the
+    zip-file.
+    """
     n_antennas = 12
-
-    def __init__(self, n_projects):
-        self.csv = bytearray()
-        # initialize header and data array
+    chunk_size = 2 ** 20  # [bytes] used to copy the csv into the zip-file
+
+    def __init__(self, path: str, size: int = 0):
+        # open the csv file and discard the rows after the given size
+        self.file = open(path, 'r+b' if size > 0 else 'w+b')
+        self.file.truncate(size)
+        self.file.seek(size)
+        # initialize header
         self.header = self.init_header()
         self.header_str = ';'.join(self.header) + '\n'
-        self.data = np.empty(
-            (n_projects * MAX_SAMPLES_PER_PROJECT, self.header.shape[0]),
-            dtype='S30'
-        )
 
     def init_header(self):
         header = [
@@ -170,7 +597,7 @@ class CSV:
             header.append('amplitude_%02i' % idx)
             header.append('phase_%02i' % idx)
         header.append('output')
-        return np.array(header).reshape(-1)
+        return header
 
     def append(
             self,
@@ -180,27 +607,57 @@ class CSV:
             cnt_out: int
     ) -> None:
         # add index
-        self.data[cnt_out, 0] = '%07i' % cnt_out
+        row = ['%07i' % cnt_out]
 
         # add each input image
-        for idx, img in enumerate(['permittivity', 'conductivity', 'density']):
-            self.data[cnt_out, idx + 1] = 'input/%s_%04i.png' % (img, cnt_in)
+        for img in ['permittivity', 'conductivity', 'density']:
+            row.append('input/%s_%04i.png' % (img, cnt_in))
 
         # add amplitudes and normalized phases
         for idx in range(self.n_antennas):
             # add amplitude
-            self.data[cnt_out, 2 * idx + 4] = \
-                '%.17f' % conf['amplitudes'][idx]
+            row.append('%.17f' % conf['amplitudes'][idx])
             # add normalized phase
-            self.data[cnt_out, 2 * idx + 5] = \
-                '%.17f' % (conf['phases'][idx] / 2 / pi)
+            row.append('%.17f' % (conf['phases'][idx] / 2 / pi))
 
         # add output img
-        self.data[cnt_out, -1] = 'output/%s_%07i.png' % (dataset, cnt_out)
-
-    def to_str(self):
-        return self.header_str + \
-               '\n'.join(';'.join(row) for row in self.data.astype(str))
-
-    def __call__(self, *args, **kwargs):
-        return self.to_str()
+        row.append('output/%s_%07i.png' % (dataset, cnt_out))
+
+        # write row
+        self.file.write((';'.join(row) + '\n').encode())
+
+    def flush(self) -> int:
+        # write the rows to disk and return the size of the csv file
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        return self.file.tell()
+
+    def save(self, zipfile: ZipFile, stale: set = frozenset(),
+             filename: str = 'dataset.csv') -> None:
+        """
+        Copies the rows into the zip-file, except the rows of the given stale
+        output images. In the dataset.csv, the rows are separated (not
+        terminated) by a line break.
+        """
+        size = self.file.tell()
+        self.file.seek(0)
+        with zipfile.open(filename, 'w', force_zip64=True) as file:
+            file.write(self.header_str.encode())
+            if stale:
+                rows = (row for row in self.file
+                        if int(row.split(b';', 1)[0]) not in stale)
+                separator = b''
+                for row in rows:
+                    file.write(separator + row.rstrip(b'\n'))
+                    separator = b'\n'
+            elif size > 0:
+                # copy all but the last line break
+                n = size - 1
+                while n > 0:
+                    chunk = self.file.read(min(self.chunk_size, n))
+                    file.write(chunk)
+                    n -= len(chunk)
+        self.file.seek(size)
+
+    def close(self) -> None:
+        self.file.close()
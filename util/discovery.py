@@ -0,0 +1,130 @@
+import hashlib
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from zipfile import ZipInfo
+
+import settings
+
+# the exported e-field that indicates that the simulation of a project is
+# finished
+EFIELD = 'e-field 11.csv'
+
+# directories of a project that are added to the dataset, and the files
+# each of them requires
+MAPS = ['conductivity', 'density', 'model', 'permittivity']
+REQUIRED = {
+    'maps': [img + '.png' for img in MAPS],
+    'msf': ['configuration.json'],
+    'sar': ['configuration.json'],
+}
+
+# index of the stat of a file in the project index
+MODE = 0
+SIZE = 1
+MTIME = 2
+
+
+def discover_projects(path_src,
+                      n_threads: int = settings.Parallel.n_threads_discovery
+                      ) -> Tuple[List[dict], Dict[str, str]]:
+    """
+    Scans the projects in path_src once, concurrently with n_threads threads
+    (each directory listing and stat is a round trip on a network file
+    system). Returns the index of the valid projects, sorted by name, and
+    the reason why each other project is invalid.
+
+    A project is valid if its simulation is finished (EFIELD exists), all
+    REQUIRED files exist and each dataset has at least one output image.
+    The index of a project is a dict with its 'name', 'path' and the stat
+    (mode, size, mtime_ns) of each file in the directories of REQUIRED:
+
+        {'name': 'project_000', 'path': '.../project_000',
+         'files': {'maps': {'density.png': (33188, 1234, 16...), ...},
+                   'msf': {...}, 'sar': {...}}}
+
+    The later stages use the index instead of listing or stat-ing the files
+    of a project again.
+    """
+    with os.scandir(path_src) as entries:
+        paths = sorted(entry.path for entry in entries if entry.is_dir())
+
+    with ThreadPoolExecutor(n_threads) as executor:
+        results = list(executor.map(_scan_project, paths))
+
+    projects, invalid = [], {}
+    for path, (project, reason) in zip(paths, results):
+        if project is None:
+            invalid[os.path.basename(path)] = reason
+        else:
+            projects.append(project)
+    return projects, invalid
+
+
+def fingerprint(project: dict) -> str:
+    # hash of the name, size and modification time of each file of the
+    # project that is added to the dataset
+    sha = hashlib.sha1()
+    for directory in REQUIRED:
+        for name, stat in sorted(project['files'][directory].items()):
+            sha.update(('%s/%s;%i;%i\n' % (
+                directory, name, stat[SIZE], stat[MTIME]
+            )).encode())
+    return sha.hexdigest()
+
+
+def output_paths(project: dict, dataset: str) -> List[str]:
+    # sorted paths of the output images of a dataset of the project
+    return [os.path.join(project['path'], dataset, name)
+            for name in sorted(project['files'][dataset])
+            if name.endswith('.png')]
+
+
+def project_size(project: dict, decode: bool = False) -> int:
+    # estimated memory [bytes] of a loaded project, i.e. the size of its
+    # files, which doubles if the images are also decoded
+    size = sum(stat[SIZE] for files in project['files'].values()
+               for stat in files.values())
+    return 2 * size if decode else size
+
+
+def zip_info(project: dict, directory: str, name: str) -> ZipInfo:
+    # the same zip info as ZipInfo.from_file, without a stat of the file
+    stat = project['files'][directory][name]
+    zinfo = ZipInfo(os.path.join(directory, name),
+                    time.localtime(stat[MTIME] // 10 ** 9)[0:6])
+    zinfo.external_attr = (stat[MODE] & 0xFFFF) << 16
+    zinfo.file_size = stat[SIZE]
+    return zinfo
+
+
+def _scan_project(path) -> Tuple[Optional[dict], str]:
+    # returns the index of the project, or None and the reason why it is
+    # not valid
+    if not os.path.exists(os.path.join(path, EFIELD)):
+        return None, 'simulation is not finished (no %s)' % EFIELD
+
+    files = {}
+    for directory, required in REQUIRED.items():
+        try:
+            with os.scandir(os.path.join(path, directory)) as entries:
+                files[directory] = {}
+                for entry in entries:
+                    stat = entry.stat()
+                    files[directory][entry.name] = (
+                        stat.st_mode, stat.st_size, stat.st_mtime_ns
+                    )
+        except FileNotFoundError:
+            return None, 'directory %s is missing' % directory
+        missing = [name for name in required if name not in files[directory]]
+        if missing:
+            return None, 'missing %s' % ', '.join(
+                '%s/%s' % (directory, name) for name in missing
+            )
+
+    for dataset in ['msf', 'sar']:
+        if not any(name.endswith('.png') for name in files[dataset]):
+            return None, 'no output images in %s' % dataset
+
+    return {'name': os.path.basename(path), 'path': path, 'files': files}, ''
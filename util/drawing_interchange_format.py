@@ -1,27 +1,31 @@
-import io
+from collections import deque
+from typing import Union
 from zipfile import ZipFile
 
 import cv2
 import dxfgrabber
 import numpy as np
-from PIL import Image
 
 import settings
+from .png_pipeline import PNGWriter, save_png
 
 
 class DrawingInterchangeFormat:
 
     def __init__(self, path_project, materials, idx):
         self.dxf = dxfgrabber.readfile(path_project.joinpath('model2d.dxf'))
+        # filename of each map, see settings.DXF.maps
         self.filenames = {
-            'per': 'input/permittivity_%03i.png' % idx,
-            'con': 'input/conductivity_%03i.png' % idx,
-            'den': 'input/density_%03i.png' % idx
+            key: 'input/%s_%03i.png' % (prop, idx)
+            for key, (prop, _, _) in settings.DXF.maps.items()
         }
         self.width = settings.Imgs.width
         self.height = settings.Imgs.height
         self.materials = materials
         self.mm_per_px = None
+        # number of contours that are not closed of each object, as found
+        # when the maps were generated, it is up to the caller to report them
+        self.open_contours = {}
         self.material_obj_names = []
         for material in materials:
             self.material_obj_names.append(material['object_name'].upper())
@@ -56,66 +60,80 @@ class DrawingInterchangeFormat:
                 ii = ii + 1
         print('  ' + '-' * 80)
 
-    def save(self, zipfile: ZipFile, mm_per_px):
+    def save(self, zipfile: Union[ZipFile, PNGWriter], mm_per_px,
+             resolution=None):
+        # the model is parsed once, it can be saved at several resolutions
+        # (width, height), by default settings.Imgs
         self.mm_per_px = mm_per_px
 
         # generate maps
-        maps = self._generate_maps()
+        maps = self._generate_maps(resolution)
 
         # save them
         for key in maps:
-            with zipfile.open(self.filenames[key], 'w') as file:
-                Image.fromarray(maps[key]).save(file, format='png')
+            save_png(zipfile, self.filenames[key], maps[key])
 
-    def _generate_maps(self):
+    def _generate_maps(self, resolution=None):
+        if resolution is None:
+            resolution = (settings.Imgs.width, settings.Imgs.height)
+
+        # maps are rasterised at a higher resolution when supersampling,
+        # and downscaled afterwards
+        ss = settings.DXF.supersample
+        width, height = ss * resolution[0], ss * resolution[1]
+
+        # pixel size [mm], either a scalar or per dimension, e.g. the
+        # mm_per_px of a ComplexFieldPerAntenna
+        mm_per_px = np.asarray(self.mm_per_px, dtype=np.float64) / ss
 
         # extract lines from entities
         objects = {}
         for ent in self.dxf.entities:
             if ent.layer not in objects:
                 objects[ent.layer] = _Object()
-            objects[ent.layer].lines.append(_Line(ent))
-
-        # combine lines into shapes,
-        #   one object consists out of 1 or multiple shapes
-        max_iter = 100
-        for _, obj in objects.items():
-            n_lines = len(obj.lines)
-            for idx in range(max_iter):
-                obj.combine_lines(0.1)
-                # break loop if number of lines did not decrease
-                if len(obj.lines) == n_lines:
-                    break
-                n_lines = len(obj.lines)
-
-        # combine lines
-        for _, obj in objects.items():
-            obj.combine_lines(0.1)
-
-        # create empty permittivity, conductivity & density maps
-        img_shape = (settings.Imgs.height, settings.Imgs.width)
-        img_per = np.ones(img_shape, np.uint8) * settings.DXF.per0
-        img_con = np.ones(img_shape, np.uint8) * settings.DXF.con0
-        img_den = np.ones(img_shape, np.uint8) * settings.DXF.den0
-
-        # draw shapes in the maps
+            objects[ent.layer].lines.append(_Line(ent, mm_per_px))
+
+        # combine lines into closed contours,
+        #   one object consists out of 1 or multiple contours
+        self.open_contours = {}
         for name, obj in objects.items():
-            m = self.materials[self.material_obj_names.index(name)]
-            cp = 255 * m['permittivity'] * settings.DXF.scalar_permittivity
-            cc = 255 * m['conductivity'] * settings.DXF.scalar_conductivity
-            cd = 255 * m['density'] * settings.DXF.scalar_density
+            n_open = obj.stitch_lines(0.1)
+            if n_open > 0:
+                self.open_contours[name] = n_open
 
+        # draw shapes once in a label image, label 0 is the background and
+        # label i + 1 is material i
+        labels = np.zeros((height, width), np.uint16)
+        for name, obj in objects.items():
+            label = self.material_obj_names.index(name) + 1
             for line in obj.lines:
-                pnts = [line.pixels(self.mm_per_px)]
-                cv2.fillPoly(img_per, pnts, color=cp)
-                cv2.fillPoly(img_con, pnts, color=cc)
-                cv2.fillPoly(img_den, pnts, color=cd)
-
-        return {'per': img_per, 'con': img_con, 'den': img_den}
+                pnts = [line.pixels(mm_per_px, width, height)]
+                cv2.fillPoly(labels, pnts, color=label)
+
+        # obtain the maps through a lookup table of the materials
+        maps = {}
+        for key, lut in self._lookup_tables().items():
+            img = lut[labels]
+            if ss > 1:
+                # average each block of ss x ss pixels (partial volumes)
+                img = img.reshape(height // ss, ss, width // ss, ss)
+                img = img.mean(axis=(1, 3))
+            maps[key] = np.clip(np.round(img), 0, 255).astype(np.uint8)
+        return maps
+
+    def _lookup_tables(self):
+        # value of each map per label, the background followed by the
+        # materials, see settings.DXF.maps
+        luts = {}
+        for key, (prop, scalar, background) in settings.DXF.maps.items():
+            values = [background] + [255 * material[prop] * scalar
+                                     for material in self.materials]
+            luts[key] = np.array(values, dtype=np.float64)
+        return luts
 
 
 class _Line:
-    def __init__(self, ent):
+    def __init__(self, ent, mm_per_px):
         if ent.mode == 'spline2d':
 
             # obtain points
@@ -130,7 +148,7 @@ class _Line:
         elif ent.mode == 'polyline2d':
             # only occurrence of this should be the circular boundary
             # with radius r, located at the center (0,0)
-            points = self.arc_to_line(ent)
+            points = self.arc_to_line(ent, mm_per_px)
 
         else:
             raise Exception('ERROR: unknown mode encountered %s' %
@@ -144,12 +162,7 @@ class _Line:
     def end(self):
         return self.points[-1, :]
 
-    def reverse(self):
-        self.points = np.flipud(self.points)
-
-    def pixels(self, mm_per_px):
-        width, height = settings.Imgs.width, settings.Imgs.height
-
+    def pixels(self, mm_per_px, width, height):
         # points are currently in [mm], convert it to [px]
         points = self.points / mm_per_px
 
@@ -169,27 +182,43 @@ class _Line:
         return points
 
     @staticmethod
-    def arc_to_line(ent):
-        points = np.array([]).reshape((-1, 2))
-        for v1, v2 in zip(ent.vertices[:-1], ent.vertices[1:]):
-            d = _distance_3d(v1.location, v2.location)
-            angle = 4 * np.arctan(v1.bulge)
-            r = np.abs(d / (2 * np.sin(0.5 * angle)))
-
-            # convert each location to angle relative to origin (0, 0)
-            theta_start = np.arctan2(v1.location[0], v1.location[1])
-            theta_end = theta_start - angle
-
-            # generate points
-            theta = np.linspace(theta_start, theta_end, settings.DXF.n_arc)
-            x = r * np.cos(theta)
-            y = r * np.sin(theta)
-            xy = np.vstack([x, y]).T
-
-            # add points to list
-            points = np.append(points, xy, 0)
-
-        # return points
+    def arc_to_line(ent, mm_per_px):
+        # location of the vertices and bulge of each segment between them
+        locations = np.array([v.location for v in ent.vertices])
+        bulge = np.array([v.bulge for v in ent.vertices[:-1]])
+
+        # segments with a bulge of 0 are straight, instead of an arc
+        straight = bulge == 0
+
+        # radius, angle & start angle of each arc (relative to origin (0, 0))
+        d = np.sum((locations[1:] - locations[:-1]) ** 2, axis=1) ** 0.5
+        angle = 4 * np.arctan(bulge)
+        r = np.zeros(len(bulge))
+        r[~straight] = np.abs(d[~straight] /
+                              (2 * np.sin(0.5 * angle[~straight])))
+        theta_start = np.arctan2(locations[:-1, 0], locations[:-1, 1])
+
+        # number of points of each arc, such that the distance between
+        # consecutive points is at most settings.DXF.arc_tolerance [px] (of
+        # the smallest dimension of the pixels)
+        length = r * np.abs(angle) / (settings.DXF.arc_tolerance *
+                                      np.min(mm_per_px))
+        n = np.maximum(np.ceil(length), 1).astype(int) + 1
+
+        # generate the points of all arcs at once, each arc from its start
+        # to its end angle (both included)
+        idx_arc = np.repeat(np.arange(len(n)), n)
+        idx_point = np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n)
+        theta = theta_start[idx_arc] - \
+            idx_point / (n[idx_arc] - 1) * angle[idx_arc]
+        r = r[idx_arc]
+        points = np.vstack([r * np.cos(theta), r * np.sin(theta)]).T
+
+        # a straight segment (of 2 points, see n) consists of its vertices,
+        # with the columns swapped as the points of the arcs
+        is_straight = straight[idx_arc]
+        idx_vertex = idx_arc[is_straight] + idx_point[is_straight]
+        points[is_straight] = locations[idx_vertex][:, [1, 0]]
         return points
 
 
@@ -197,51 +226,75 @@ class _Object:
     def __init__(self):
         self.lines = []
 
-    def combine_lines(self, thr):
-        # loop through lines
-        idx = 0
-        while (idx + 1) < len(self.lines):
-
-            # check if line[idx+1] can be added at the end of line[idx]
-            if _distance(self.lines[idx].end(),
-                         self.lines[idx + 1].start()) < thr:
-                self._append_lines(idx, idx + 1)
+    def stitch_lines(self, thr) -> int:
+        """
+        Chains the lines into contours, by joining each end to the nearest
+        endpoint (within distance thr) of another line. The endpoints are
+        indexed once in a hash grid with cells of size thr, such that only
+        the endpoints in the neighbouring cells are compared. The lines are
+        processed in order, and the result is deterministic.
+
+        Returns the number of contours that are not closed.
+        """
+        lines = self.lines
+        if not lines:
+            return 0
+
+        # endpoint 2 * i is the start and 2 * i + 1 the end of line i
+        endpoints = np.array([point for line in lines
+                              for point in (line.start(), line.end())])
+        cells = [tuple(cell) for cell in
+                 np.floor(endpoints / thr).astype(np.int64)]
+        grid = {}
+        for idx, cell in enumerate(cells):
+            grid.setdefault(cell, []).append(idx)
+
+        used = np.zeros(len(lines), dtype=bool)
+
+        def nearest(point):
+            # nearest endpoint of an unused line within distance thr
+            idx_nearest, d_nearest = None, thr
+            cx, cy = np.floor(point / thr).astype(np.int64)
+            for cell in [(cx + dx, cy + dy)
+                         for dx in (-1, 0, 1) for dy in (-1, 0, 1)]:
+                for idx in grid.get(cell, ()):
+                    d = _distance(point, endpoints[idx])
+                    if not used[idx // 2] and d < d_nearest:
+                        idx_nearest, d_nearest = idx, d
+            return idx_nearest
+
+        contours = []
+        n_open = 0
+        for idx_line, line in enumerate(lines):
+            if used[idx_line]:
                 continue
-
-            # check if line[idx+1] can be added at the start of line [idx]
-            if _distance(self.lines[idx + 1].end(),
-                         self.lines[idx].start()) < thr:
-                self._append_lines(idx + 1, idx)
-                continue
-
-            # check the same but with the reverse
-            self.lines[idx + 1].reverse()
-            if _distance(self.lines[idx].end(),
-                         self.lines[idx + 1].start()) < thr:
-                self._append_lines(idx, idx + 1)
-                continue
-
-            idx += 1
-
-    def _append_lines(self, idx1, idx2):
-        # append points
-        self.lines[idx1].points = np.append(
-            self.lines[idx1].points,
-            self.lines[idx2].points,
-            axis=0
-        )
-        # set new end point
-        self.lines[idx1].end = self.lines[idx2].end
-        # remove second line
-        del self.lines[idx2]
+            used[idx_line] = True
+            chain = deque([line.points])
+
+            # extend the contour at its end, then at its start
+            for at_end in (True, False):
+                while _distance(chain[0][0], chain[-1][-1]) >= thr:
+                    point = chain[-1][-1] if at_end else chain[0][0]
+                    idx = nearest(point)
+                    if idx is None:
+                        break
+                    used[idx // 2] = True
+                    points = lines[idx // 2].points
+                    # the end of the contour continues at the start of the
+                    # next line, and its start at the end of the previous
+                    if at_end:
+                        chain.append(points if idx % 2 == 0 else points[::-1])
+                    else:
+                        chain.appendleft(points if idx % 2 else points[::-1])
+
+            if _distance(chain[0][0], chain[-1][-1]) >= thr:
+                n_open += 1
+            line.points = np.concatenate(chain)
+            contours.append(line)
+
+        self.lines = contours
+        return n_open
 
 
 def _distance(point1, point2):
     return np.sum((point1 - point2) ** 2) ** 0.5
-
-
-def _distance_3d(v1, v2):
-    dx = v1[0] - v2[0]
-    dy = v1[1] - v2[1]
-    dz = v1[2] - v2[2]
-    return (dx ** 2 + dy ** 2 + dz ** 2) ** 0.5
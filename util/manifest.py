@@ -0,0 +1,196 @@
+import json
+import os
+from pathlib import Path
+from typing import Dict, List, Optional
+from zipfile import ZipFile
+
+from .compression import zip_kwargs
+from .statistics import from_dicts, merge_all, to_dicts
+
+
+class Manifest:
+    """
+    Keeps track of the progress of a (partition of a) dataset, such that a
+    build can be resumed after it crashed, or updated incrementally once new
+    projects are added.
+
+    For each project that is added to the dataset, the fingerprint of its
+    files, the index ranges of its input/output images and (optionally) the
+    moments of its images (see util.statistics, without the histograms) are
+    recorded. The statistics of all projects that are added, including the
+    histograms, are merged per dataset, these are those of the dataset as
+    long as no images are stale. The
+    manifest is only saved at a checkpoint, together with the state of each
+    archive (see Archive), such that the manifest and archives on disk are
+    always consistent.
+
+    Images of projects that are modified or removed can not be removed from
+    the zip archives, their index ranges are marked as stale instead. Stale
+    images are not listed in the dataset.csv, a full rebuild discards them.
+    """
+
+    def __init__(self, path: str, datasets: List[str]):
+        self.path = path
+        self.datasets = datasets
+
+        # project name -> fingerprint & index ranges
+        self.projects: Dict[str, dict] = {}
+
+        # index ranges [start, stop) of the stale output images
+        self.stale: Dict[str, List[List[int]]] = {d: [] for d in datasets}
+
+        # counters of the next input/output image
+        self.cnt_in = 0
+        self.cnt_out = {d: 0 for d in datasets}
+
+        # merged statistics of the projects that are added, None once a
+        # project without statistics is added
+        self.statistics: Dict[str, Optional[dict]] = {d: {} for d in datasets}
+
+        # state of the archive and csv of each dataset at the last checkpoint
+        self.checkpoint: Dict[str, dict] = {}
+
+    def load(self) -> 'Manifest':
+        # start with an empty manifest if none is saved yet
+        if not Path(self.path).exists():
+            return self
+        with open(self.path, 'r') as file:
+            data = json.load(file)
+        if data['datasets'] != self.datasets:
+            raise Exception('ERROR: manifest %s is of datasets %s' %
+                            (self.path, data['datasets']))
+        self.projects = data['projects']
+        self.stale = data['stale']
+        self.cnt_in = data['cnt_in']
+        self.cnt_out = data['cnt_out']
+        self.statistics = data.get('statistics', {d: None for d in
+                                                  self.datasets})
+        self.checkpoint = data['checkpoint']
+        return self
+
+    def save(self) -> None:
+        # write to a temporary file first, such that a crash while saving
+        # does not corrupt the manifest
+        data = {
+            'datasets': self.datasets,
+            'projects': self.projects,
+            'stale': self.stale,
+            'cnt_in': self.cnt_in,
+            'cnt_out': self.cnt_out,
+            'statistics': self.statistics,
+            'checkpoint': self.checkpoint,
+        }
+        with open(self.path + '.tmp', 'w') as file:
+            json.dump(data, file)
+        os.replace(self.path + '.tmp', self.path)
+
+    def update(self, names: List[str], fingerprints: List[str]) -> List[int]:
+        """
+        Marks the projects that are removed or modified as stale, and returns
+        the ids of the given projects that are not (or no longer) part of
+        the dataset.
+        """
+        current = dict(zip(names, fingerprints))
+        for name in list(self.projects):
+            if current.get(name) != self.projects[name]['fingerprint']:
+                project = self.projects.pop(name)
+                for dataset in self.datasets:
+                    self.stale[dataset].append(project['cnt_out'][dataset])
+        return [idx for idx, name in enumerate(names)
+                if name not in self.projects]
+
+    def add(self, name: str, fingerprint: str, cnt_in: int,
+            cnt_out: Dict[str, List[int]],
+            statistics: Optional[Dict[str, dict]] = None) -> None:
+        # 'statistics' holds the Statistics of each input channel ('inputs')
+        # and of the output images of each dataset ('outputs')
+        self.projects[name] = {
+            'fingerprint': fingerprint,
+            'cnt_in': cnt_in,
+            'cnt_out': cnt_out,
+            'statistics': None if statistics is None else {
+                'inputs': to_dicts(statistics['inputs'], histogram=False),
+                'outputs': {
+                    dataset: statistics_.to_dict(histogram=False)
+                    for dataset, statistics_ in statistics['outputs'].items()
+                },
+            },
+        }
+        for dataset in self.datasets:
+            if statistics is None or self.statistics[dataset] is None:
+                self.statistics[dataset] = None
+                continue
+            merged = from_dicts(self.statistics[dataset])
+            merge_all(merged, {**statistics['inputs'],
+                               'output': statistics['outputs'][dataset]})
+            self.statistics[dataset] = to_dicts(merged)
+
+    def stale_ids(self, dataset: str) -> set:
+        # indices of the stale output images of the given dataset
+        ids = set()
+        for start, stop in self.stale[dataset]:
+            ids.update(range(start, stop))
+        return ids
+
+
+class Archive:
+    """
+    Zip archive that can be checkpointed. At a checkpoint the archive is
+    closed, such that its central directory is written, and the central
+    directory (the tail of the file) is copied to a separate file. The
+    archive is then reopened to append the next images, which overwrites the
+    central directory.
+
+    Restoring a checkpoint truncates the archive to the end of the last
+    image of that checkpoint and appends the copied central directory. This
+    discards images that were written after the checkpoint (e.g. because
+    the build crashed) and the dataset.csv of a finished build.
+    """
+
+    def __init__(self, path: str, checkpoint: Optional[dict] = None):
+        self.path = path
+        self.tail = None
+        self.tails_old = []
+        if checkpoint is None:
+            self.fp = open(path, 'w+b')
+            self.zipfile = ZipFile(self.fp, 'w', **zip_kwargs())
+        else:
+            # restore the archive to its state at the checkpoint
+            self.tail = checkpoint['tail']
+            self.fp = open(path, 'r+b')
+            self.fp.truncate(checkpoint['offset'])
+            self.fp.seek(checkpoint['offset'])
+            with open(self.tail, 'rb') as file:
+                self.fp.write(file.read())
+            self.zipfile = ZipFile(self.fp, 'a', **zip_kwargs())
+
+    def checkpoint(self) -> dict:
+        # end of the last image, the central directory is written from here
+        offset = self.fp.tell()
+
+        # write the central directory and copy it to a separate file
+        self.zipfile.close()
+        tail = '%s.%i.cd' % (self.path, offset)
+        self.fp.seek(offset)
+        with open(tail, 'wb') as file:
+            file.write(self.fp.read())
+
+        # reopen the archive to append the next images
+        self.zipfile = ZipFile(self.fp, 'a', **zip_kwargs())
+
+        # remember the copy of the previous checkpoint, it is removed once
+        # the manifest that refers to the new copy is saved
+        if self.tail != tail:
+            self.tails_old.append(self.tail)
+        self.tail = tail
+        return {'offset': offset, 'tail': tail}
+
+    def remove_old_tails(self) -> None:
+        for tail in self.tails_old:
+            if tail is not None:
+                Path(tail).unlink(missing_ok=True)
+        self.tails_old = []
+
+    def close(self) -> None:
+        self.zipfile.close()
+        self.fp.close()
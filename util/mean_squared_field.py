@@ -1,10 +1,14 @@
-import io
+import hashlib
+from typing import Tuple, Union
+
 import numpy as np
 from PIL import Image
-from zipfile import ZipInfo, ZipFile
+from zipfile import ZipFile
 
 import settings
 from util.complex_field_per_antenna import REAL, IMAG, ComplexFieldPerAntenna
+from util.npy_shards import ShardWriter
+from util.png_pipeline import PNGWriter, save_png
 
 
 class MeanSquareField:
@@ -17,22 +21,52 @@ class MeanSquareField:
     amplitudes of the other antennas are chosen  at random within the range
     as defined in settings.MSF.
 
-    The msf image is scaled by 'settings.MSF.scalar'
+    The random numbers are drawn in blocks of settings.MSF.rng_block
+    samples. Each block has its own generator, derived from the root seed
+    (settings.MSF.seed), the project name and the index of the block within
+    the project (see block_rng). A sample is the row of its block, and is
+    therefore the same regardless of the order in which the projects and
+    samples are generated, or by which process.
+
+    The msf image is scaled by 'scalar' (by default 'settings.MSF.scalar',
+    see calibrate_scalar to obtain it from a subset of the samples) and
+    clipped to [0, 255], or to [0, 65535] for 16-bit images (see
+    settings.MSF.bit_depth).
+
+    The msf is computed in the precision of the cfa (see
+    ComplexFieldPerAntenna), i.e. with complex64 fields for a float32 cfa.
 
     This object will stop iterating after 'settings.MSF.n' samples are
     generated.
+
+    Besides one sample at a time (generate_msf), a batch of samples can be
+    generated at once (generate_msf_batch), which is much faster.
     """
 
-    def __init__(self, cfa_obj: ComplexFieldPerAntenna):
+    def __init__(self, cfa_obj: ComplexFieldPerAntenna, seed=None,
+                 scalar=None):
         self.cfa_obj = cfa_obj
+        self.seed = settings.MSF.seed if seed is None else seed
+        self.scalar = settings.MSF.scalar if scalar is None else scalar
+
+        # number of samples generated for this project
+        self.n_generated = 0
+
+        # (index, phases, amplitudes) of the last block of random numbers
+        self._block = None
+
+        # complex field of each antenna, shape [n_antenna, n_points * (x,y,z)]
+        self.dtype = cfa_obj.cfa.dtype
+        dtype_complex = np.result_type(self.dtype, np.complex64)
+        self.fields = np.empty(cfa_obj.cfa.shape[:3], dtype=dtype_complex)
+        self.fields.real = cfa_obj.cfa[:, :, :, REAL]
+        self.fields.imag = cfa_obj.cfa[:, :, :, IMAG]
+        self.fields = self.fields.transpose((1, 0, 2)).reshape(cfa_obj.na, -1)
 
         # pre-allocate space
-        self.cfa = np.zeros(cfa_obj.cfa.shape)
-        self.msf = np.zeros((cfa_obj.np, 1))
+        self.msf = np.zeros((cfa_obj.np, 1), dtype=self.dtype)
 
         # define attributes
-        self.cos_phase = None
-        self.sin_phase = None
         self.phases = None
         self.amplitudes = None
         self.n_phaseshifts = None
@@ -41,70 +75,112 @@ class MeanSquareField:
 
     def generate_msf(self, idx):
 
-        # generate random phases, note that phase of first antenna is 0
-        self.phases = np.random.uniform(
-            low=settings.MSF.phase_limit[0],
-            high=settings.MSF.phase_limit[1],
-            size=self.cfa_obj.na
-        )
-        self.phases[0] = 0.
-
-        # generate random amplitudes
-        self.amplitudes = np.random.uniform(
-            low=settings.MSF.amplitude_limit[0],
-            high=settings.MSF.amplitude_limit[1],
-            size=self.cfa_obj.na
-        )
-
-        # apply phase shifts to cfa
-        self._shift_cfa()
-
-        # apply scaling to cfa (amplitudes)
-        self._scale_cfa()
-
-        # calculate msf
-        self._mean_square()
+        # generate random phases & amplitudes, and calculate msf
+        batch = self.generate_msf_batch(idx, 1)
+        self.phases = batch.phases[0]
+        self.amplitudes = batch.amplitudes[0]
+        self.msf = batch.msf[0]
 
         # set idx & filename
         self.idx = idx
-        self.filename = 'output/msf_%07i.png' % idx
+        self.filename = batch.filenames[0]
 
         # return msf as image
         return self
 
-    def save(self, zipfile: ZipFile):
-        with zipfile.open(self.filename, 'w') as file:
-            Image.fromarray(self.to_img()).save(file, format='png')
+    def generate_msf_batch(self, idx, n,
+                           idx_sample=None) -> 'MeanSquareFieldBatch':
+        """
+        Generates n samples at once, with (dataset) indices idx, idx+1, ...,
+        idx+n-1. The samples are the samples idx_sample, ..., idx_sample+n-1
+        of the project, by default the n samples after the ones that are
+        already generated. The samples are therefore equal to those of n
+        consecutive calls of generate_msf (up to the rounding of the matrix
+        product).
+        """
+        na = self.cfa_obj.na
+        if idx_sample is None:
+            idx_sample = self.n_generated
+        self.n_generated = max(self.n_generated, idx_sample + n)
 
-    def to_img(self) -> np.ndarray:
-        img_shape = (settings.Imgs.width, settings.Imgs.height)
-        img_scaled = 255 * self.msf.reshape(img_shape) * settings.MSF.scalar
-        return img_scaled.astype(np.uint8)
+        # take the random phases and amplitudes of each sample from its
+        # block (see _random_block)
+        block = settings.MSF.rng_block
+        ids = idx_sample + np.arange(n)
+        phases = np.empty((n, na))
+        amplitudes = np.empty((n, na))
+        for idx_block in np.unique(ids // block):
+            in_block = ids // block == idx_block
+            phases_block, amplitudes_block = self._random_block(idx_block)
+            phases[in_block] = phases_block[ids[in_block] % block]
+            amplitudes[in_block] = amplitudes_block[ids[in_block] % block]
+
+        msf = self._mean_square_batched(phases, amplitudes)
+        return MeanSquareFieldBatch(idx, phases, amplitudes, msf,
+                                    idx_sample, self._shape(), self.scalar)
 
-    def _shift_cfa(self):
-        # todo: find a different solution to slicing, since that will return
-        #  a copy of the ndarray (i think), this  increases computation time
+    def _random_block(self, idx_block) -> Tuple[np.ndarray, np.ndarray]:
+        # random phases and amplitudes of the samples of a block, drawn at
+        # once from the generator of the block, note that phase of first
+        # antenna is 0. The last block is kept for the next samples.
+        if self._block is None or self._block[0] != idx_block:
+            rng = block_rng(self.cfa_obj.name, idx_block, self.seed)
+            size = (settings.MSF.rng_block, self.cfa_obj.na)
+            phases = rng.uniform(low=settings.MSF.phase_limit[0],
+                                 high=settings.MSF.phase_limit[1],
+                                 size=size)
+            phases[:, 0] = 0.
+            amplitudes = rng.uniform(low=settings.MSF.amplitude_limit[0],
+                                     high=settings.MSF.amplitude_limit[1],
+                                     size=size)
+            self._block = (idx_block, phases, amplitudes)
+        return self._block[1], self._block[2]
 
-        # cfa : ndarray, shape [n_points, n_antenna, (x,y,z), (real,imag) ]
+    def _shape(self):
+        # the points are ordered by x first, i.e. point (ix, iz) is at
+        # iz * width + ix (see complex_field_per_antenna._generate_xz)
+        return self.cfa_obj.height, self.cfa_obj.width
 
-        # reshape cos_phase and sin_phase such that numpy knows which
-        # dimension must be multiplied element-wise
-        cos_phase = np.cos(self.phases).reshape(1, -1, 1)
-        sin_phase = np.sin(self.phases).reshape(1, -1, 1)
+    def _mean_square_batched(self, phases, amplitudes):
+        # calculate the msf in batches of limited size, such that the
+        # intermediate complex field remains small
+        n = len(phases)
+        msf = np.empty((n, self.cfa_obj.np), dtype=self.dtype)
+        step = settings.MSF.batch_size
+        for start in range(0, n, step):
+            stop = min(start + step, n)
+            msf[start:stop] = self._mean_square(phases[start:stop],
+                                                amplitudes[start:stop])
+        return msf
 
-        # real and imag part of cfa
-        cfa_real = self.cfa_obj.cfa[:, :, :, REAL]
-        cfa_imag = self.cfa_obj.cfa[:, :, :, IMAG]
+    def _mean_square(self, phases, amplitudes):
+        """
+        The msf of a sample with complex weights w = amplitude * e^(j phase)
+        is, per point p, the quadratic form 0.5 * w^H G_p w with the Gram
+        matrix G_p = F_p^H F_p of the complex fields F_p [(x,y,z), antenna].
+        Since G_p has rank 3 at most, it is evaluated in its factored form
+        0.5 * |F_p w|^2, which is a single matrix product for the batch.
+        """
+        weights = (amplitudes * np.exp(1j * phases)).astype(self.fields.dtype)
+        field = weights @ self.fields
+        field_squared = field.real ** 2 + field.imag ** 2
+        return 0.5 * field_squared.reshape(
+            len(phases), self.cfa_obj.np, -1
+        ).sum(axis=2)
 
-        # shift cfa
-        self.cfa[:, :, :, REAL] = cfa_real * cos_phase - cfa_imag * sin_phase
-        self.cfa[:, :, :, IMAG] = cfa_imag * cos_phase + cfa_real * sin_phase
+    def save(self, zipfile: Union[ZipFile, PNGWriter]):
+        save_png(zipfile, self.filename, self.to_img())
 
-    def _scale_cfa(self):
-        self.cfa *= self.amplitudes.reshape(1, -1, 1, 1)
+    def save_npy(self, writer: ShardWriter):
+        # append the msf image and its amplitudes and normalized phases (in
+        # the order of the dataset.csv) to the .npy shards
+        parameters = np.empty(2 * self.cfa_obj.na)
+        parameters[0::2] = self.amplitudes
+        parameters[1::2] = self.phases / (2 * np.pi)
+        writer.append(output=self.to_img(), parameters=parameters)
 
-    def _mean_square(self):
-        self.msf = 0.5 * np.sum(np.sum(self.cfa, axis=1) ** 2, axis=(1, 2))
+    def to_img(self) -> np.ndarray:
+        return quantize(self.msf.reshape(self._shape()), self.scalar)
 
     def export_as_png(self, dst, width, height, efield2_max):
 
@@ -126,3 +202,94 @@ class MeanSquareField:
 
         # return filename
         return dst
+
+
+def quantize(msf: np.ndarray, scalar: float,
+             bit_depth: int = None) -> np.ndarray:
+    # scale the msf to [0, 255] (uint8) or [0, 65535] (uint16) for a bit
+    # depth (by default settings.MSF.bit_depth) of 8 or 16, values beyond
+    # are clipped (instead of wrapped around by the conversion)
+    if bit_depth is None:
+        bit_depth = settings.MSF.bit_depth
+    if bit_depth not in (8, 16):
+        raise Exception('ERROR: bit depth %r is not supported, use 8 or 16'
+                        % bit_depth)
+    maximum = 2 ** bit_depth - 1
+    dtype = np.uint8 if bit_depth == 8 else np.uint16
+    return np.clip(maximum * scalar * msf, 0, maximum).astype(dtype)
+
+
+def project_key(name: str) -> int:
+    # integer key of a project, which is the same in each run and process
+    return int.from_bytes(hashlib.sha1(name.encode()).digest()[:8], 'little')
+
+
+def block_rng(project: str, idx_block: int,
+              seed=None) -> np.random.Generator:
+    """
+    Returns the random generator of block 'idx_block' (of
+    settings.MSF.rng_block samples) of the given project, which is
+    independent of the generators of all other blocks.
+    """
+    seed = settings.MSF.seed if seed is None else seed
+    return np.random.default_rng(np.random.SeedSequence(
+        seed, spawn_key=(project_key(project), int(idx_block))
+    ))
+
+
+def rng_metadata(seed=None) -> dict:
+    # describes how the random numbers of each sample are generated, such
+    # that it can be stored with the samples that are generated from them
+    return {
+        'seed': settings.MSF.seed if seed is None else seed,
+        'bit_generator': 'PCG64',
+        'rng_block': settings.MSF.rng_block,
+        'block_rng': 'numpy.random.SeedSequence(seed, spawn_key=('
+                     'project_key(project), idx_sample // rng_block)), with '
+                     'project_key the first 8 bytes (little endian) of the '
+                     'sha1 of the project name',
+        'sample': 'row idx_sample % rng_block of the phases and then of the '
+                  'amplitudes [rng_block, n_antenna] drawn from the block, '
+                  'the phase of the first antenna is 0',
+    }
+
+
+class MeanSquareFieldBatch:
+    """
+    Batch of msf samples, as generated by MeanSquareField.generate_msf_batch.
+    The phases and amplitudes have shape [n, n_antenna] and the msf has
+    shape [n, n_points], with n_points = height * width of 'shape' (by
+    default settings.Imgs), the shape of the images.
+    """
+
+    def __init__(self, idx, phases, amplitudes, msf, idx_sample=0,
+                 shape=None, scalar=None):
+        self.idx = idx + np.arange(len(msf))
+        self.idx_sample = idx_sample + np.arange(len(msf))
+        self.phases = phases
+        self.amplitudes = amplitudes
+        self.msf = msf
+        if shape is None:
+            shape = (settings.Imgs.height, settings.Imgs.width)
+        self.shape = tuple(shape)
+        self.scalar = settings.MSF.scalar if scalar is None else scalar
+        self.filenames = ['output/msf_%07i.png' % idx_ for idx_ in self.idx]
+
+    def __len__(self):
+        return len(self.msf)
+
+    def save(self, zipfile: Union[ZipFile, PNGWriter]):
+        for filename, img in zip(self.filenames, self.to_imgs()):
+            save_png(zipfile, filename, img)
+
+    def save_npy(self, writer: ShardWriter):
+        # see MeanSquareField.save_npy
+        parameters = np.empty((len(self), 2 * self.phases.shape[1]))
+        parameters[:, 0::2] = self.amplitudes
+        parameters[:, 1::2] = self.phases / (2 * np.pi)
+        for img, parameters_ in zip(self.to_imgs(), parameters):
+            writer.append(output=img, parameters=parameters_)
+
+    def to_imgs(self) -> np.ndarray:
+        return quantize(self.msf.reshape((len(self),) + self.shape),
+                        self.scalar)
@@ -0,0 +1,48 @@
+import sys
+from collections import deque
+from typing import Callable, Iterable, Iterator, Optional
+
+try:
+    # not available on windows
+    import resource
+except ImportError:
+    resource = None
+
+
+def imap_bounded(pool, func: Callable, items: Iterable, sizes: Iterable[int],
+                 budget: int) -> Iterator:
+    """
+    Like pool.imap(func, items), but an item is only submitted to the pool
+    while the total (estimated) size of the items in flight, i.e. submitted
+    and not yet returned, stays within the budget [bytes]. Pool.imap submits
+    all items at once, such that the results pile up in memory whenever they
+    are consumed slower than they are produced. At least one item is in
+    flight, and the results are returned in order of the items.
+    """
+    pending = deque()
+    in_flight = 0
+    for item, size in zip(items, sizes):
+        # wait for the oldest results until the item fits in the budget
+        while pending and in_flight + size > budget:
+            result, size_result = pending.popleft()
+            in_flight -= size_result
+            yield result.get()
+        pending.append((pool.apply_async(func, (item,)), size))
+        in_flight += size
+    while pending:
+        result, _ = pending.popleft()
+        yield result.get()
+
+
+def peak_rss(children: bool = False) -> Optional[int]:
+    """
+    Returns the peak resident set size [bytes] of this process, or of its
+    largest (terminated) child process if 'children' is True. Returns None
+    if it is not available (on windows).
+    """
+    if resource is None:
+        return None
+    who = resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF
+    rss = resource.getrusage(who).ru_maxrss
+    # linux reports kilobytes, macos bytes
+    return rss if sys.platform == 'darwin' else rss * 1024
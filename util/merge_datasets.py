@@ -0,0 +1,126 @@
+import io
+import json
+import re
+from shutil import copyfileobj
+from tempfile import TemporaryFile
+from typing import List
+from zipfile import ZipFile
+
+from .cst_to_dataset import CSV
+from .compression import zip_kwargs
+from .statistics import from_dicts, merge_all, to_dicts
+
+# patterns of the filenames (and csv entries) of the input and output imgs
+RE_INPUT = re.compile(r'^input/(\w+)_(\d{4})\.png$')
+RE_OUTPUT = re.compile(r'^output/(\w+)_(\d{7})\.png$')
+
+
+def merge_datasets(paths_src: List[str], path_dst: str, print_=print):
+    """
+    Merges the dataset zip-files of each partition (see cst_to_dataset) into
+    a single dataset. The input images, output images and the idx column of
+    the dataset.csv are renumbered, such that the result equals the dataset
+    that would be obtained by converting all projects in a single run.
+    The statistics in the metadata.json of the partitions are merged.
+    """
+
+    # create merged dataset
+    zipfile_dst = ZipFile(path_dst, 'w', **zip_kwargs())
+
+    # counters to keep track of input/output images
+    cnt_in = 0  # counter of input imgs
+    cnt_out = 0  # counter of output imgs
+
+    # the rows of the merged dataset.csv are streamed to a temporary file
+    csv = TemporaryFile('w+b')
+    header = None
+    n_rows = 0
+    metadata = None
+    statistics = {}
+    for path_src in paths_src:
+        print_('merging %s...' % path_src)
+        zipfile_src = ZipFile(path_src, 'r')
+
+        # number of input and output images in this partition
+        n_in, n_out = 0, 0
+
+        # copy each image with its renumbered filename
+        for zinfo in zipfile_src.infolist():
+            if zinfo.filename == 'dataset.csv':
+                continue
+            # the metadata is the same for each partition, except for the
+            # statistics, it is added after the dataset.csv
+            if zinfo.filename == 'metadata.json':
+                metadata = json.loads(zipfile_src.read(zinfo))
+                merge_all(statistics,
+                          from_dicts(metadata.get('statistics', {})))
+                continue
+            data = zipfile_src.read(zinfo)
+            filename = zinfo.filename
+            match = RE_INPUT.match(filename)
+            if match is not None:
+                idx = int(match.group(2))
+                n_in = max(n_in, idx + 1)
+                zinfo.filename = 'input/%s_%04i.png' % \
+                                 (match.group(1), idx + cnt_in)
+            match = RE_OUTPUT.match(filename)
+            if match is not None:
+                idx = int(match.group(2))
+                n_out = max(n_out, idx + 1)
+                zinfo.filename = 'output/%s_%07i.png' % \
+                                 (match.group(1), idx + cnt_out)
+            zipfile_dst.writestr(zinfo, data)
+
+        # renumber the rows of the dataset.csv
+        with zipfile_src.open('dataset.csv', 'r') as file:
+            lines = io.TextIOWrapper(file, newline='')
+            header_src = lines.readline()
+            if header is None:
+                header = header_src
+                csv.write(header.encode())
+            elif header != header_src:
+                raise Exception('ERROR: header of dataset.csv in %s differs'
+                                % path_src)
+            for line in lines:
+                if n_rows > 0:
+                    csv.write(b'\n')
+                row = _renumber(line.rstrip('\n').split(';'), cnt_in, cnt_out)
+                csv.write(row.encode())
+                n_rows += 1
+
+        zipfile_src.close()
+        print_('\t...done')
+
+        # update counters
+        cnt_in += n_in
+        cnt_out += n_out
+
+    # add csv to dataset
+    print_('adding dataset.csv...')
+    csv.seek(0)
+    with zipfile_dst.open('dataset.csv', 'w', force_zip64=True) as file:
+        copyfileobj(csv, file, CSV.chunk_size)
+    csv.close()
+    if metadata is not None:
+        if statistics:
+            metadata['statistics'] = to_dicts(statistics)
+        zipfile_dst.writestr('metadata.json', json.dumps(metadata, indent=4))
+    zipfile_dst.close()
+    print_('\t...done')
+
+
+def _renumber(row: List[str], cnt_in: int, cnt_out: int) -> str:
+    for idx, value in enumerate(row):
+        if idx == 0:
+            row[idx] = '%07i' % (int(value) + cnt_out)
+            continue
+        match = RE_INPUT.match(value)
+        if match is not None:
+            row[idx] = 'input/%s_%04i.png' % \
+                       (match.group(1), int(match.group(2)) + cnt_in)
+            continue
+        match = RE_OUTPUT.match(value)
+        if match is not None:
+            row[idx] = 'output/%s_%07i.png' % \
+                       (match.group(1), int(match.group(2)) + cnt_out)
+    return ';'.join(row)
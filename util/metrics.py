@@ -0,0 +1,124 @@
+import json
+from contextlib import contextmanager
+from time import perf_counter, time
+from typing import Dict, Iterable, Optional
+
+import settings
+
+
+class Metrics:
+    """
+    Low-overhead instrumentation of the stages of a build. The wall time,
+    number of items and number of bytes of each stage are accumulated per
+    project and in total, either through 'add' or the 'stage' context
+    manager:
+
+        with metrics.stage('write', n_items=1, n_bytes=len(data)):
+            ...
+
+    Each finished project (see 'end_project') is written as a line of json
+    to the metrics file, the totals are written as the last line by
+    'close':
+
+        {"project": "...", "stages": {"write": {"seconds": 0.1,
+                                                "items": 40,
+                                                "bytes": 81920}, ...}}
+        {"total": {...}, "seconds": 12.3, "n_projects": 100, ...}
+
+    Once every settings.Metrics.interval seconds, 'end_project' returns a
+    line with the throughput and estimated time of arrival of the build.
+    """
+
+    def __init__(self, path: str, n_projects: int,
+                 stages_written: Iterable[str] = ('write',)):
+        self.file = open(path, 'w')
+        self.n_projects = n_projects
+        self.n_done = 0
+
+        # stages of which the items and bytes are the output of the build
+        self.stages_written = stages_written
+
+        # [seconds, items, bytes] of each stage
+        self.project: Dict[str, list] = {}
+        self.total: Dict[str, list] = {}
+
+        self.timer = time()
+        self.timer_progress = self.timer
+
+    def add(self, stage: str, seconds: float, n_items: int = 0,
+            n_bytes: int = 0) -> None:
+        for stages in (self.project, self.total):
+            if stage not in stages:
+                stages[stage] = [0., 0, 0]
+            stats = stages[stage]
+            stats[0] += seconds
+            stats[1] += n_items
+            stats[2] += n_bytes
+
+    @contextmanager
+    def stage(self, stage: str, n_items: int = 0, n_bytes: int = 0):
+        timer = perf_counter()
+        yield
+        self.add(stage, perf_counter() - timer, n_items, n_bytes)
+
+    def timed(self, iterable: Iterable, stage: str):
+        # yields the items of iterable, the time spent waiting for each item
+        # is added to the stage
+        iterator = iter(iterable)
+        while True:
+            timer = perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            self.add(stage, perf_counter() - timer, 1)
+            yield item
+
+    def end_project(self, name: str) -> Optional[str]:
+        self.file.write(json.dumps({
+            'project': name, 'stages': _stages_dict(self.project)
+        }) + '\n')
+        self.project = {}
+        self.n_done += 1
+
+        # return a progress line regularly, and after the last project
+        if time() - self.timer_progress < settings.Metrics.interval and \
+                self.n_done < self.n_projects:
+            return None
+        self.timer_progress = time()
+        return self.progress()
+
+    def progress(self) -> str:
+        seconds = time() - self.timer
+        n_items = sum(self.total[stage][1] for stage in self.stages_written
+                      if stage in self.total)
+        n_bytes = sum(self.total[stage][2] for stage in self.stages_written
+                      if stage in self.total)
+        eta = seconds / max(self.n_done, 1) * (self.n_projects - self.n_done)
+        return '%i/%i projects | %.1f projects/min | %.1f images/s | ' \
+               '%.2f MB/s | ETA %s' % (
+                   self.n_done, self.n_projects,
+                   60 * self.n_done / seconds, n_items / seconds,
+                   n_bytes / seconds / 2 ** 20, _format_seconds(eta)
+               )
+
+    def close(self, **kwargs) -> None:
+        # kwargs are added to the totals, e.g. the peak memory usage
+        self.file.write(json.dumps({
+            'total': _stages_dict(self.total),
+            'seconds': time() - self.timer,
+            'n_projects': self.n_done,
+            **kwargs
+        }) + '\n')
+        self.file.close()
+
+
+def _stages_dict(stages: Dict[str, list]) -> dict:
+    return {stage: {'seconds': stats[0], 'items': stats[1],
+                    'bytes': stats[2]} for stage, stats in stages.items()}
+
+
+def _format_seconds(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return '%i:%02i:%02i' % (hours, minutes, seconds)
@@ -0,0 +1,128 @@
+import json
+import os
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+class ShardWriter:
+    """
+    Writes samples to contiguous .npy shards, such that a training loader
+    can np.memmap (np.load(..., mmap_mode='r')) a shard and slice batches
+    without any decoding or copying.
+
+    Each sample consists of one or more named arrays, e.g. an output image
+    and its parameters. The arrays of 'shard_size' samples are collected in
+    memory and saved as <name>_<shard>.npy, with the samples along the first
+    axis. The index.json in the directory lists each shard with the range
+    [start, stop) of sample indices it contains, and the dtype and shape of
+    each array:
+
+        {
+            "shards": [{"start": 0, "stop": 65536,
+                        "files": {"output": "output_00000.npy", ...}}, ...],
+            "arrays": {"output": {"dtype": "uint8", "shape": [32, 32]}, ...},
+            "stale": [[start, stop], ...]
+        }
+
+    Samples in the 'stale' ranges belong to projects that are modified or
+    removed since they were added (see util.manifest), they should be
+    skipped by the loader.
+    """
+
+    def __init__(self, path_dir: str, shard_size: int,
+                 shards: Optional[List[dict]] = None):
+        self.path_dir = Path(path_dir)
+        self.path_dir.mkdir(parents=True, exist_ok=True)
+        self.shard_size = shard_size
+
+        # shards that are saved, restored from a checkpoint if given
+        self.shards: List[dict] = [] if shards is None else shards
+        self.n = self.shards[-1]['stop'] if self.shards else 0
+
+        # arrays of the current (unsaved) shard
+        self.buffer: Dict[str, np.ndarray] = {}
+        self.n_buffer = 0
+        self.arrays: Dict[str, dict] = {}
+
+    def append(self, **arrays) -> int:
+        """
+        Appends a sample, consisting of the given named arrays, and returns
+        its index.
+        """
+        # allocate the buffer of the shard once the arrays are known
+        if not self.buffer:
+            for name, array in arrays.items():
+                array = np.asarray(array)
+                self.buffer[name] = np.empty(
+                    (self.shard_size,) + array.shape, dtype=array.dtype
+                )
+                self.arrays[name] = {'dtype': array.dtype.str,
+                                     'shape': list(array.shape)}
+
+        for name, array in arrays.items():
+            self.buffer[name][self.n_buffer] = array
+        self.n_buffer += 1
+        self.n += 1
+
+        # save the shard once it is full
+        if self.n_buffer == self.shard_size:
+            self.flush()
+        return self.n - 1
+
+    def flush(self) -> None:
+        # save the samples in the buffer as a (possibly partial) shard
+        if self.n_buffer == 0:
+            return
+        idx = len(self.shards)
+        files = {}
+        for name, buffer in self.buffer.items():
+            files[name] = '%s_%05i.npy' % (name, idx)
+            np.save(self.path_dir.joinpath(files[name]),
+                    buffer[:self.n_buffer])
+        self.shards.append({'start': self.n - self.n_buffer,
+                            'stop': self.n,
+                            'files': files})
+        self.n_buffer = 0
+
+    def checkpoint(self, stale: Optional[List[List[int]]] = None) -> list:
+        # save the current shard and index, return the saved shards
+        self.flush()
+        self.save_index(stale)
+        return self.shards
+
+    def save_index(self, stale: Optional[List[List[int]]] = None) -> None:
+        # the arrays are only known after a sample is appended, otherwise
+        # they are obtained from the first shard
+        if not self.arrays and self.shards:
+            for name, file in self.shards[0]['files'].items():
+                array = np.load(self.path_dir.joinpath(file), mmap_mode='r')
+                self.arrays[name] = {'dtype': array.dtype.str,
+                                     'shape': list(array.shape[1:])}
+        index = {
+            'shards': self.shards,
+            'arrays': self.arrays,
+            'stale': [] if stale is None else stale,
+        }
+        path = self.path_dir.joinpath('index.json')
+        with open(str(path) + '.tmp', 'w') as file:
+            json.dump(index, file)
+        os.replace(str(path) + '.tmp', path)
+
+
+def load_shards(path_dir: str) -> Tuple[dict, List[Dict[str, np.memmap]]]:
+    """
+    Returns the index of the shards in the given directory (see ShardWriter)
+    and the memory-mapped arrays of each shard.
+    """
+    path_dir = Path(path_dir)
+    with open(path_dir.joinpath('index.json'), 'r') as file:
+        index = json.load(file)
+    shards = []
+    for shard in index['shards']:
+        shards.append({
+            name: np.load(path_dir.joinpath(file), mmap_mode='r')
+            for name, file in shard['files'].items()
+        })
+    return index, shards
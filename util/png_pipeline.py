@@ -0,0 +1,144 @@
+import copy
+import io
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional, Tuple, Union
+from zipfile import ZipFile, ZipInfo
+
+import numpy as np
+from PIL import Image
+
+import settings
+from .compression import png_kwargs, zip_kwargs
+
+
+class PNGWriter:
+    """
+    Pipeline stage that encodes images to PNG and writes them to a zip-file,
+    concurrently with the code that produces the images.
+
+    The images are encoded by a pool of threads into in-memory buffers (zlib
+    releases the GIL while compressing). A single writer thread appends the
+    buffers to the zip-file, in the order in which the images are submitted.
+    The queue between both is bounded, such that 'submit' blocks once the
+    encoding or writing falls too far behind. Images that are already
+    encoded (e.g. the staged images of cst_to_dataset) are submitted through
+    'submit_staged', these are only written by the writer thread.
+
+    An error of the encoding or writing is raised by the next call of
+    'submit', 'flush' or 'close', the images after it are not written.
+
+    With n_threads = 0 the images are encoded and written in the calling
+    thread instead, which avoids the contention of the threads for the GIL
+    (e.g. on a single cpu).
+
+    Use it as a context manager, all images are written when it exits:
+
+        with PNGWriter(zipfile) as writer:
+            for msf in ...:
+                msf.save(writer)
+    """
+
+    def __init__(self, zipfile: ZipFile,
+                 n_threads: int = settings.Parallel.n_threads_png,
+                 queue_size: int = settings.Parallel.queue_size):
+        self.zipfile = zipfile
+        self.error: Optional[BaseException] = None
+        self.executor, self.queue, self.thread = None, None, None
+        if n_threads > 0:
+            self.executor = ThreadPoolExecutor(n_threads)
+            self.queue = queue.Queue(queue_size)
+            self.thread = threading.Thread(target=self._write, daemon=True)
+            self.thread.start()
+
+    def submit(self, filename: str, img: np.ndarray) -> None:
+        # note that the image should not be modified after it is submitted
+        self._raise()
+        if self.thread is None:
+            self.zipfile.writestr(filename, encode_png(img))
+        else:
+            self.queue.put((filename, self.executor.submit(encode_png, img)))
+
+    def submit_staged(self, filename: str,
+                      staged: Tuple[ZipInfo, bytes]) -> None:
+        # write an encoded image with its zip info under filename
+        self._raise()
+        if self.thread is None:
+            write_staged(self.zipfile, staged, filename)
+        else:
+            self.queue.put((filename, staged))
+
+    def flush(self) -> None:
+        # wait until the submitted images are written, e.g. before the
+        # zip-file is closed or replaced (self.zipfile may be replaced after
+        # this)
+        if self.thread is not None:
+            self.queue.join()
+        self._raise()
+
+    def close(self) -> None:
+        # wait until all images are written
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.executor.shutdown()
+        self._raise()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _write(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                # skip the remaining images once an error occurred
+                if self.error is not None:
+                    continue
+                filename, data = item
+                if isinstance(data, Future):
+                    self.zipfile.writestr(filename, data.result())
+                else:
+                    write_staged(self.zipfile, data, filename)
+            except BaseException as error:
+                self.error = error
+            finally:
+                self.queue.task_done()
+
+    def _raise(self):
+        if self.error is not None:
+            raise self.error
+
+
+def encode_png(img: np.ndarray) -> bytes:
+    buffer = io.BytesIO()
+    Image.fromarray(img).save(buffer, **png_kwargs())
+    return buffer.getvalue()
+
+
+def write_staged(zipfile: ZipFile, staged: Tuple[ZipInfo, bytes],
+                 filename: str) -> None:
+    # the zip info is copied, since the zip-file keeps (and writestr sets
+    # the offset and crc of) the given object, while the staged input
+    # images are written to each dataset
+    zinfo = copy.copy(staged[0])
+    zinfo.filename = filename
+    kwargs = zip_kwargs()
+    zipfile.writestr(zinfo, staged[1],
+                     compress_type=kwargs['compression'],
+                     compresslevel=kwargs['compresslevel'])
+
+
+def save_png(dst: Union[ZipFile, PNGWriter], filename: str,
+             img: np.ndarray) -> None:
+    # save the image either through the pipeline or directly in the zip-file
+    if isinstance(dst, PNGWriter):
+        dst.submit(filename, img)
+    else:
+        with dst.open(filename, 'w') as file:
+            Image.fromarray(img).save(file, **png_kwargs())
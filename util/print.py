@@ -1,5 +1,8 @@
+import atexit
 import os
+import queue
 import subprocess
+import threading
 from datetime import datetime
 
 # os.name = nt: Windows OR posix: Linux
@@ -7,6 +10,13 @@ is_running_on_desktop = os.name == 'nt'
 
 
 class Print:
+    """
+    Prints messages and logs them, with a timestamp, to a file. The messages
+    are written by a background thread to the file, which is opened once and
+    buffered, such that logging does not wait on the file system. The file
+    is flushed whenever no messages are pending. Call 'close' to write the
+    remaining messages, which is also done at exit.
+    """
     print_log = True
 
     def __init__(self, path_log, partition_id: int):
@@ -14,8 +24,13 @@ class Print:
 
         # create empty file
         print(self.path_log)
-        with open(self.path_log, 'w') as file:
-            file.write('')
+        self.file = open(self.path_log, 'w')
+
+        # start the writer
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._write, daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
 
         # write system info
         self.log(system_info(partition_id))
@@ -33,20 +48,33 @@ class Print:
         if self.print_log:
             print(msg)
 
-        # append message to log
-        with open(self.path_log, 'a') as file:
+        # split msg at linebreaks, and prefix each line with either a
+        # timestamp or indent
+        lines = []
+        for idx, line in enumerate(str(msg).splitlines()):
+            if idx == 0:
+                lines.append(self._timestamp() + line + '\n')
+            else:
+                lines.append(self._indent() + line + '\n')
 
-            # split msg at linebreaks
-            for idx, line in enumerate(str(msg).splitlines()):
+        # append message to log
+        self.queue.put(''.join(lines))
 
-                # write either a timestamp or indent
-                if idx == 0:
-                    file.write(self._timestamp())
-                else:
-                    file.write(self._indent())
+    def close(self):
+        # write the remaining messages and close the file
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        self.file.close()
 
-                # write the line
-                file.write(line + '\n')
+    def _write(self):
+        while True:
+            text = self.queue.get()
+            if text is None:
+                return
+            self.file.write(text)
+            if self.queue.empty():
+                self.file.flush()
 
 
 def system_info(partition_id: int) -> str:
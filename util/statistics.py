@@ -0,0 +1,142 @@
+from typing import Dict, Optional
+
+import numpy as np
+
+
+class Statistics:
+    """
+    Streaming statistics of the values of a channel: count, mean, variance
+    (Welford's algorithm, with the update of Chan et al. to add a batch of
+    values at once), minimum, maximum and histogram. Statistics of separate
+    parts (e.g. projects or partitions) are combined with 'merge', which
+    gives the same result (up to rounding) as a single pass over all values.
+
+    The histogram has a bin per uint8 value, unless the bin edges are given
+    (e.g. 256 bins of 256 values for uint16 images, see image_edges). Values
+    outside the edges are counted in the first or last bin. Statistics
+    without a histogram (see to_dict) keep only the moments, merging them
+    with other statistics drops the histogram.
+    """
+
+    def __init__(self, edges: Optional[np.ndarray] = None):
+        self.n = 0
+        self.mean = 0.
+        self.m2 = 0.  # sum of squared differences from the mean
+        self.min = np.inf
+        self.max = -np.inf
+        self.edges = None if edges is None else np.asarray(edges, float)
+        n_bins = 256 if edges is None else len(self.edges) - 1
+        self.histogram = np.zeros(n_bins, dtype=np.int64)
+
+    def update(self, values: np.ndarray) -> None:
+        values = np.asarray(values)
+        if values.size == 0:
+            return
+        if self.histogram is not None:
+            self._update_histogram(values)
+        values = values.astype(np.float64)
+        mean = values.mean()
+        self._combine(values.size, mean, np.sum((values - mean) ** 2),
+                      values.min(), values.max())
+
+    def _update_histogram(self, values: np.ndarray) -> None:
+        if self.edges is None:
+            counts = values if values.dtype == np.uint8 else \
+                np.clip(values, 0, 255).astype(np.uint8)
+            self.histogram += np.bincount(counts.ravel(), minlength=256)
+        else:
+            idx = np.searchsorted(self.edges, values.ravel(), 'right') - 1
+            idx = np.clip(idx, 0, len(self.histogram) - 1)
+            self.histogram += np.bincount(idx, minlength=len(self.histogram))
+
+    def merge(self, other: 'Statistics') -> None:
+        if self.histogram is None or other.histogram is None:
+            self.histogram = None
+        elif len(self.histogram) != len(other.histogram):
+            raise Exception('ERROR: statistics with different histogram '
+                            'bins cannot be merged')
+        else:
+            self.histogram += other.histogram
+        if other.n > 0:
+            self._combine(other.n, other.mean, other.m2, other.min, other.max)
+
+    def _combine(self, n, mean, m2, min_, max_):
+        total = self.n + n
+        delta = mean - self.mean
+        self.mean += delta * n / total
+        self.m2 += m2 + delta ** 2 * self.n * n / total
+        self.n = total
+        self.min = min(self.min, min_)
+        self.max = max(self.max, max_)
+
+    @property
+    def var(self) -> float:
+        return self.m2 / self.n if self.n > 0 else 0.
+
+    def percentile(self, q: float) -> float:
+        # approximate percentile from the histogram (upper edge of the bin)
+        if self.histogram is None:
+            raise Exception('ERROR: statistics without a histogram have no '
+                            'percentiles')
+        cumsum = np.cumsum(self.histogram)
+        idx = int(np.searchsorted(cumsum, q / 100 * cumsum[-1]))
+        if self.edges is None:
+            return float(idx)
+        return float(self.edges[idx + 1])
+
+    def to_dict(self, histogram: bool = True) -> dict:
+        # without the histogram (and its edges) if 'histogram' is False
+        data = {
+            'n': self.n,
+            'mean': self.mean,
+            'std': self.var ** 0.5,
+            'm2': self.m2,
+            'min': None if self.n == 0 else float(self.min),
+            'max': None if self.n == 0 else float(self.max),
+        }
+        if histogram and self.histogram is not None:
+            data['histogram'] = self.histogram.tolist()
+            if self.edges is not None:
+                data['edges'] = self.edges.tolist()
+        return data
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'Statistics':
+        statistics = cls(data.get('edges'))
+        statistics.n = data['n']
+        statistics.mean = data['mean']
+        statistics.m2 = data['m2']
+        if data['n'] > 0:
+            statistics.min = data['min']
+            statistics.max = data['max']
+        statistics.histogram = None if 'histogram' not in data else \
+            np.array(data['histogram'], dtype=np.int64)
+        return statistics
+
+
+def image_edges(img: np.ndarray) -> Optional[np.ndarray]:
+    # histogram edges of the values of an image: a bin per value of uint8
+    # images (None), 256 bins of 256 values for uint16 images
+    if img.dtype == np.uint16:
+        return np.linspace(0, 2 ** 16, 257)
+    return None
+
+
+def merge_all(statistics: Dict[str, Statistics],
+              other: Dict[str, Statistics]) -> None:
+    # merges the statistics of each channel of other into statistics
+    for channel, statistics_ in other.items():
+        if channel not in statistics:
+            statistics[channel] = Statistics(statistics_.edges)
+        statistics[channel].merge(statistics_)
+
+
+def to_dicts(statistics: Dict[str, Statistics],
+             histogram: bool = True) -> dict:
+    return {channel: statistics_.to_dict(histogram)
+            for channel, statistics_ in statistics.items()}
+
+
+def from_dicts(data: dict) -> Dict[str, Statistics]:
+    return {channel: Statistics.from_dict(statistics_)
+            for channel, statistics_ in data.items()}
@@ -0,0 +1,185 @@
+import argparse
+import json
+from pathlib import Path
+
+import numpy as np
+
+import settings
+from .complex_field_per_antenna import COLUMNS, ComplexFieldPerAntenna
+from .drawing_interchange_format import DrawingInterchangeFormat
+from .mean_squared_field import MeanSquareField, rng_metadata
+from .png_pipeline import encode_png
+
+# e-field columns of a CST export, in the order they are exported
+EFIELD_COLUMNS = COLUMNS[:1] + ['y [mm]'] + COLUMNS[1:]
+
+# radius of the head (outer boundary) of the model [mm]
+RADIUS = 100.
+
+
+def generate_project(path_project, n_antennas: int = 12,
+                     grid=(101, 91), n_outputs: int = 20,
+                     n_objects: int = 3, n_points: int = 200,
+                     n_pieces: int = 4, seed: int = 0) -> list:
+    """
+    Writes a fake but structurally valid CST project, for benchmarks and
+    tests of the tool without the generated projects of CST:
+
+        e-field NN.csv      random e-field of each of the n_antennas, on a
+                            regular grid of grid = (nx, nz) points
+        model2d.dxf         circular head with n_objects elliptic objects
+                            inside, each object consists of n_points points
+                            split into n_pieces (shuffled, partially
+                            reversed) polylines
+        maps/*.png          maps of the model, rasterised from the dxf
+        msf|sar/*.png       n_outputs output images with their
+        configuration.json  configuration
+        rng.json            how the random numbers of the samples are
+                            generated (see rng_metadata)
+
+    The e-fields and the model are random with the given seed. The samples
+    are drawn as MeanSquareField draws them, with the root seed of
+    settings.MSF.seed (and the name of the project).
+
+    Returns the materials of the objects of the model, as needed by
+    DrawingInterchangeFormat.
+    """
+    rng = np.random.default_rng(seed)
+    path_project = Path(path_project)
+    path_project.mkdir(parents=True, exist_ok=True)
+
+    # e-field of each antenna
+    x = np.linspace(-RADIUS, RADIUS, grid[0])
+    z = np.linspace(-RADIUS, RADIUS, grid[1])
+    xx, zz = np.meshgrid(x, z, indexing='ij')
+    for idx_antenna in range(n_antennas):
+        values = rng.normal(scale=100., size=(xx.size, 6))
+        data = np.column_stack([xx.ravel(), np.zeros(xx.size), zz.ravel(),
+                                values])
+        with open(path_project.joinpath(
+                'e-field %02i.csv' % (idx_antenna + 1)), 'w') as file:
+            file.write(';'.join(EFIELD_COLUMNS) + '\n')
+            np.savetxt(file, data, delimiter=';', fmt='%.6f')
+
+    # model & its materials
+    materials = [{'object_name': 'head', 'permittivity': 40.,
+                  'conductivity': 0.5, 'density': 1000.}]
+    for idx in range(n_objects):
+        materials.append({
+            'object_name': 'object_%i' % idx,
+            'permittivity': rng.uniform(1., 80.),
+            'conductivity': rng.uniform(0., 1.),
+            'density': rng.uniform(900., 2000.),
+        })
+    _write_dxf(path_project.joinpath('model2d.dxf'), n_objects, n_points,
+               n_pieces, rng)
+
+    # maps of the model, the model map is a copy of the permittivity
+    dxf = DrawingInterchangeFormat(path_project, materials, 0)
+    cfa = ComplexFieldPerAntenna(path_project)
+    dxf.mm_per_px = cfa.mm_per_px
+    maps = dxf._generate_maps()
+    if dxf.open_contours:
+        raise Exception('ERROR: the contours of %s in %s are not closed' %
+                        (', '.join(dxf.open_contours), dxf.dxf.filename))
+    path_project.joinpath('maps').mkdir(exist_ok=True)
+    for key, img in [('permittivity', maps['per']),
+                     ('conductivity', maps['con']),
+                     ('density', maps['den']),
+                     ('model', maps['per'])]:
+        path_project.joinpath('maps', key + '.png').write_bytes(
+            encode_png(img)
+        )
+
+    # output images and their configuration, the sar images are the msf
+    # images with another scale
+    batch = MeanSquareField(cfa).generate_msf_batch(0, n_outputs)
+    imgs = batch.to_imgs()
+    for dataset, scale in [('msf', 1.), ('sar', 0.5)]:
+        path_dataset = path_project.joinpath(dataset)
+        path_dataset.mkdir(exist_ok=True)
+        cnf = []
+        for idx, img in enumerate(imgs):
+            filename = '%s_%04i.png' % (dataset, idx)
+            path_dataset.joinpath(filename).write_bytes(
+                encode_png((img * scale).astype(img.dtype))
+            )
+            cnf.append({'filename': filename,
+                        'amplitudes': list(batch.amplitudes[idx]),
+                        'phases': list(batch.phases[idx])})
+        with open(path_dataset.joinpath('configuration.json'), 'w') as file:
+            json.dump(cnf, file)
+    with open(path_project.joinpath('rng.json'), 'w') as file:
+        json.dump(rng_metadata(), file, indent=4)
+
+    return materials
+
+
+def generate_projects(path_dst, n_projects: int, **kwargs) -> None:
+    # generate n_projects projects in path_dst, each with its own seed
+    for idx in range(n_projects):
+        generate_project(Path(path_dst).joinpath('project_%05i' % idx),
+                         seed=idx, **kwargs)
+
+
+def _write_dxf(path, n_objects, n_points, n_pieces, rng):
+    # the head is a circle of two arcs (bulge 1), the objects are ellipses
+    # that are split into polylines
+    entities = _polyline('HEAD', [(RADIUS, 0.), (-RADIUS, 0.), (RADIUS, 0.)],
+                         bulges=[1., 1., 0.])
+    for idx in range(n_objects):
+        center = rng.uniform(-0.3 * RADIUS, 0.3 * RADIUS, 2)
+        axes = rng.uniform(0.1 * RADIUS, 0.5 * RADIUS, 2)
+        theta = np.linspace(0, 2 * np.pi, n_points + 1) + rng.uniform(0, 1)
+        points = np.column_stack([center[0] + axes[0] * np.cos(theta),
+                                  center[1] + axes[1] * np.sin(theta)])
+
+        # split the ellipse at random points, shuffle & reverse the pieces
+        cuts = np.sort(rng.choice(np.arange(1, n_points), n_pieces - 1,
+                                  replace=False))
+        bounds = np.concatenate([[0], cuts, [n_points]])
+        for idx_piece in rng.permutation(n_pieces):
+            piece = points[bounds[idx_piece]:(bounds[idx_piece + 1] + 1)]
+            if rng.random() < 0.5:
+                piece = piece[::-1]
+            entities += _polyline('OBJECT_%i' % idx, piece, spline=True)
+
+    lines = ['0', 'SECTION', '2', 'ENTITIES'] + entities + \
+        ['0', 'ENDSEC', '0', 'EOF']
+    with open(path, 'w') as file:
+        file.write('\n'.join(lines) + '\n')
+
+
+def _polyline(layer, points, bulges=None, spline=False) -> list:
+    # tags of a (R12) POLYLINE entity, either a polyline with bulges or a
+    # spline fit
+    tags = ['0', 'POLYLINE', '8', layer, '66', '1',
+            '10', '0', '20', '0', '30', '0', '70', '4' if spline else '0']
+    if spline:
+        tags += ['75', '6']
+    for idx, (x, y) in enumerate(points):
+        tags += ['0', 'VERTEX', '8', layer,
+                 '10', repr(float(x)), '20', repr(float(y)), '30', '0']
+        if bulges is not None:
+            tags += ['42', repr(float(bulges[idx]))]
+        if spline:
+            tags += ['70', '8']
+    return tags + ['0', 'SEQEND', '8', layer]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("path_dst", help="directory of the projects")
+    parser.add_argument("--n_projects", type=int, default=10)
+    parser.add_argument("--n_antennas", type=int, default=12)
+    parser.add_argument("--grid", type=int, nargs=2, default=[101, 91])
+    parser.add_argument("--n_outputs", type=int, default=20)
+    parser.add_argument("--n_objects", type=int, default=3)
+    parser.add_argument("--n_points", type=int, default=200)
+    parser.add_argument("--n_pieces", type=int, default=4)
+    args = parser.parse_args()
+    settings.Cache.enabled = False
+    generate_projects(args.path_dst, args.n_projects,
+                      n_antennas=args.n_antennas, grid=tuple(args.grid),
+                      n_outputs=args.n_outputs, n_objects=args.n_objects,
+                      n_points=args.n_points, n_pieces=args.n_pieces)
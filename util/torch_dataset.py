@@ -0,0 +1,192 @@
+import io
+import os
+import struct
+import zlib
+from typing import Dict, List
+from zipfile import ZipFile, ZIP_DEFLATED, ZIP_STORED
+
+import numpy as np
+import torch
+from PIL import Image
+
+# local file header of a zip member, see the zip specification
+LOCAL_HEADER = struct.Struct('<4s5H3L2H')
+LOCAL_HEADER_SIGNATURE = b'PK\x03\x04'
+
+# number of bytes read beyond the filename, such that the local extra field
+# and data of a member are (usually) read in a single read
+EXTRA_SLACK = 64
+
+
+class CSTDataset(torch.utils.data.Dataset):
+    """
+    PyTorch Dataset of a dataset_<msf|sar>.zip, as created by cst_to_dataset.
+
+    The dataset.csv is parsed once and the offset of each member is obtained
+    from the central directory once. Each worker process of a DataLoader
+    opens its own file handle to the archive, the members are read directly
+    at their offset (without a ZipFile lookup) and the PNGs are decoded into
+    preallocated tensors. Since all samples of a project share the same
+    input images, the decoded inputs are cached per worker.
+
+    A sample is a dict with:
+        'input': uint8 tensor [3, H, W], permittivity, conductivity, density
+        'parameters': float32 tensor [24], amplitude & normalized phase of
+            each antenna
+        'output': uint8 tensor [1, H, W], or int32 tensor for 16-bit output
+            images (see settings.MSF.bit_depth)
+
+    '__getitems__' returns a batch as a dict of stacked tensors, use
+    'collate' as collate_fn of the DataLoader to pass it through as is:
+
+        dataset = CSTDataset('dataset_msf.zip')
+        loader = DataLoader(dataset, batch_size=256, shuffle=True,
+                            num_workers=8, collate_fn=CSTDataset.collate)
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+        # read the dataset.csv and the central directory
+        with ZipFile(path, 'r') as zipfile:
+            lines = zipfile.read('dataset.csv').decode().splitlines()
+            members = {zinfo.filename: zinfo for zinfo in zipfile.infolist()}
+
+        # parse the dataset.csv
+        header = lines[0].split(';')
+        rows = [line.split(';') for line in lines[1:]]
+        self.n = len(rows)
+        self.parameters = np.array(
+            [row[4:-1] for row in rows], dtype=np.float32
+        ).reshape(self.n, len(header) - 5)
+
+        # member index of the input and output image(s) of each sample, the
+        # input images are shared by the samples of a project
+        self.members: List[tuple] = []
+        ids_member: Dict[str, int] = {}
+        self.inputs = np.empty((self.n, 3), dtype=np.int64)
+        self.outputs = np.empty(self.n, dtype=np.int64)
+        for idx, row in enumerate(rows):
+            for col, filename in enumerate(row[1:4] + [row[-1]]):
+                if filename not in ids_member:
+                    ids_member[filename] = len(self.members)
+                    zinfo = members[filename]
+                    self.members.append((
+                        zinfo.header_offset,
+                        len(zinfo.filename.encode()),
+                        zinfo.compress_size,
+                        zinfo.compress_type
+                    ))
+                if col < 3:
+                    self.inputs[idx, col] = ids_member[filename]
+                else:
+                    self.outputs[idx] = ids_member[filename]
+
+        self.filenames = list(ids_member)
+
+        # file handle (per process) and cache of decoded input images
+        self._pid = None
+        self._file = None
+        self._zipfile = None
+        self._cache: Dict[int, np.ndarray] = {}
+
+        # shape of the images
+        self.shape_input, self.shape_output = (0, 0), (0, 0)
+        self.dtype_output = torch.uint8
+        if self.n > 0:
+            self.shape_input = self._decode(self.inputs[0, 0]).shape
+            output = self._decode(self.outputs[0])
+            self.shape_output = output.shape
+            if output.dtype == np.uint16:
+                self.dtype_output = torch.int32
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, idx):
+        batch = self.__getitems__([idx])
+        return {key: value[0] for key, value in batch.items()}
+
+    def __getitems__(self, indices) -> Dict[str, torch.Tensor]:
+        # preallocate the tensors of the batch
+        n = len(indices)
+        inputs = torch.empty((n, 3) + self.shape_input, dtype=torch.uint8)
+        outputs = torch.empty((n, 1) + self.shape_output,
+                              dtype=self.dtype_output)
+        inputs_np, outputs_np = inputs.numpy(), outputs.numpy()
+
+        # decode the images into the tensors
+        for idx_batch, idx in enumerate(indices):
+            for col in range(3):
+                inputs_np[idx_batch, col] = self._input(self.inputs[idx, col])
+            outputs_np[idx_batch, 0] = self._decode(self.outputs[idx])
+
+        return {
+            'input': inputs,
+            'parameters': torch.from_numpy(self.parameters[indices]),
+            'output': outputs,
+        }
+
+    @staticmethod
+    def collate(batch):
+        # the batch is already collated by __getitems__
+        return batch
+
+    def _input(self, idx_member: int) -> np.ndarray:
+        # decoded input images are cached, they are shared by many samples
+        if idx_member not in self._cache:
+            self._cache[idx_member] = self._decode(idx_member)
+        return self._cache[idx_member]
+
+    def _decode(self, idx_member: int) -> np.ndarray:
+        return np.asarray(Image.open(io.BytesIO(self._read(idx_member))))
+
+    def _read(self, idx_member: int) -> bytes:
+        # (re)open the archive in each (worker) process
+        if self._pid != os.getpid():
+            self._open()
+
+        offset, n_filename, size, compress_type = self.members[idx_member]
+
+        # other compression methods are read through a ZipFile
+        if compress_type not in (ZIP_STORED, ZIP_DEFLATED):
+            if self._zipfile is None:
+                self._zipfile = ZipFile(self._file, 'r')
+            return self._zipfile.read(self.filenames[idx_member])
+
+        # read the local header, filename, extra field and data at once
+        n = LOCAL_HEADER.size + n_filename + EXTRA_SLACK + size
+        buffer = self._pread(n, offset)
+        header = LOCAL_HEADER.unpack_from(buffer)
+        if header[0] != LOCAL_HEADER_SIGNATURE:
+            raise Exception('ERROR: bad local header of member at %i in %s' %
+                            (offset, self.path))
+        start = LOCAL_HEADER.size + header[9] + header[10]
+        data = buffer[start:(start + size)]
+        if len(data) < size:
+            data = self._pread(size, offset + start)
+
+        if compress_type == ZIP_DEFLATED:
+            return zlib.decompress(data, -15)
+        return data
+
+    def _open(self):
+        self._pid = os.getpid()
+        self._file = open(self.path, 'rb')
+        self._zipfile = None
+
+    def _pread(self, n: int, offset: int) -> bytes:
+        # os.pread is not available on windows
+        if hasattr(os, 'pread'):
+            return os.pread(self._file.fileno(), n, offset)
+        self._file.seek(offset)
+        return self._file.read(n)
+
+    def __getstate__(self):
+        # the file handles are not passed to the worker processes
+        state = self.__dict__.copy()
+        state['_pid'] = None
+        state['_file'] = None
+        state['_zipfile'] = None
+        state['_cache'] = {}
+        return state